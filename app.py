@@ -1,53 +1,501 @@
-from flask import Flask, render_template, request, redirect, send_file, url_for, jsonify, flash, session
+from flask import Flask, render_template, request, redirect, send_file, url_for, jsonify, flash, session, g, Response, stream_with_context, has_app_context
+import io
+import csv
 import tempfile
 import os
+import re
+import json
+import random
+import base64
+import pickle
+import time
+import uuid
+import shutil
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from collections import Counter, OrderedDict, namedtuple
+import numpy as np
 import pandas as pd
 import sqlite3
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 
 app = Flask(__name__)
 app.secret_key = "your_secret"
 
+logger = logging.getLogger(__name__)
+
+# SQLite caps the number of bound parameters per statement (999 on older builds)
+SQLITE_MAX_PARAMS = 900
+
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # --- Load environment variables ---
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 
 # Connect database 
-def get_connection():
-    from urllib.parse import urlparse
-    import ssl
+def get_database_url():
+    return os.getenv("DATABASE_URL", "sqlite:///employee.db")
 
-    db_url = os.getenv("DATABASE_URL", "sqlite:///employee.db")
 
-    if db_url.startswith("postgresql://"):
-        print("Connecting to PostgreSQL (host)...")
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
+def get_connection():
+    # Opens a fresh, unpooled connection (CLI scripts, benchmarks, init_db).
+    # Request handlers should use get_db() instead.
+    db_url = get_database_url()
 
+    if db_url.startswith("postgresql://"):
         if "sslmode" not in db_url:
             db_url += "?sslmode=require"
 
-        conn = psycopg2.connect(db_url, sslmode="require")
+        conn = psycopg2.connect(db_url, sslmode="require", cursor_factory=InstrumentedPGCursor)
     else:
         # Local SQLite
-        print("Using local SQLite database...")
         db_path = db_url.replace("sqlite:///", "")
         conn = sqlite3.connect(
             db_path,
             timeout=10,              
-            check_same_thread=False  
+            check_same_thread=False,
+            factory=InstrumentedSQLiteConnection
         )
         conn.execute("PRAGMA busy_timeout = 5000")  
+        conn.execute("PRAGMA journal_mode = WAL")
 
     return conn
 
 
+# --- Connection pool ---
+# Postgres: one ThreadedConnectionPool per worker process (rebuilt after a
+# gunicorn fork). SQLite: one cached connection per thread.
+# Request threads, JOB_WORKERS job threads and streamed responses all share the
+# DB_POOL_MAX connections. ThreadedConnectionPool fails at once when it is
+# empty, so checkouts queue on a semaphore for up to DB_POOL_TIMEOUT seconds
+# and then answer 503 (PoolExhausted) instead of a 500.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+_pg_pool = None
+_pg_pool_slots = None
+_pg_pool_pid = None
+_pg_pool_lock = threading.Lock()
+_sqlite_local = threading.local()
+
+
+class PoolExhausted(RuntimeError):
+    pass
+
+
+def _get_pg_pool():
+    global _pg_pool, _pg_pool_slots, _pg_pool_pid
+    if _pg_pool is None or _pg_pool_pid != os.getpid():
+        with _pg_pool_lock:
+            if _pg_pool is None or _pg_pool_pid != os.getpid():
+                db_url = get_database_url()
+                if "sslmode" not in db_url:
+                    db_url += "?sslmode=require"
+                logger.info("Opening PostgreSQL pool (min=%d, max=%d)", DB_POOL_MIN, DB_POOL_MAX)
+                _pg_pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, db_url, sslmode="require", cursor_factory=InstrumentedPGCursor
+                )
+                _pg_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pg_pool_pid = os.getpid()
+    return _pg_pool
+
+
+def checkout_connection():
+    db_url = get_database_url()
+    if db_url.startswith("postgresql://"):
+        pool = _get_pg_pool()
+        if not _pg_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise PoolExhausted(f"No database connection free after {DB_POOL_TIMEOUT:g}s (DB_POOL_MAX={DB_POOL_MAX})")
+        try:
+            return pool.getconn()
+        except Exception:
+            _pg_pool_slots.release()
+            raise
+
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None or _sqlite_local.url != db_url:
+        conn = get_connection()
+        _sqlite_local.conn = conn
+        _sqlite_local.url = db_url
+    return conn
+
+
+def release_connection(conn):
+    if isinstance(conn, sqlite3.Connection):
+        # Keep the cached connection, but never leak an open transaction
+        if conn.in_transaction:
+            conn.rollback()
+        return
+
+    pool = _get_pg_pool()
+    try:
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            return
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        pool.putconn(conn)
+    finally:
+        _pg_pool_slots.release()
+
+
+def get_db():
+    # Connection bound to the current app context, returned to the pool on teardown
+    if "db_conn" not in g:
+        g.db_conn = checkout_connection()
+        ensure_schema(g.db_conn)
+    return g.db_conn
+
+
+@app.errorhandler(PoolExhausted)
+def pool_exhausted(e):
+    logger.warning("%s: %s %s", e, request.method, request.path)
+    if request.path.startswith("/api/"):
+        resp = jsonify({"error": "Server busy, please retry"})
+    else:
+        resp = app.response_class("Server busy, please retry in a moment.", mimetype="text/plain")
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
+
+@app.teardown_appcontext
+def close_db(error):
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        release_connection(conn)
+
+
+# --- Instrumentation ---
+# Employee DB connections hand out instrumented cursors that count queries,
+# time spent and rows per "scope" (one HTTP request or one background job).
+# Totals are exported at /metrics in Prometheus text format; counters are per
+# process, so scrape every gunicorn worker (or run one) to see all traffic.
+# Requests running more than REQUEST_QUERY_WARN queries are logged: that is
+# the signature of a per-row loop (N+1).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+REQUEST_QUERY_WARN = int(os.getenv("REQUEST_QUERY_WARN", "200"))
+# PROFILE: off | header (requests sent with "X-Profile: 1") | sample (PROFILE_SAMPLE_RATE of requests)
+PROFILE = os.getenv("PROFILE", "off").lower()
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_DIR = os.path.abspath(os.getenv("PROFILE_DIR", "profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class MetricsRegistry:
+    # Minimal thread-safe counters and histograms rendered as Prometheus text
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self._meta[name] = ("histogram", help_text, buckets)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self):
+        def number(value):
+            # Full precision: :g keeps 6 digits, which stalls counters past a million
+            return str(value) if isinstance(value, int) else repr(float(value))
+
+        def fmt(labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{fmt(labels)} {number(value)}")
+                continue
+            for (n, labels), (counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bound, c in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', f'{bound:g}')])} {c}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{fmt(labels)} {number(total)}")
+                lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+METRICS.counter("app_http_requests_total", "HTTP requests by endpoint and status.")
+METRICS.histogram("app_http_request_duration_seconds", "HTTP request latency, including streamed bodies.",
+                  LATENCY_BUCKETS)
+METRICS.counter("app_db_queries_total", "Statements executed on the employee database.")
+METRICS.counter("app_db_query_seconds_total", "Time spent executing statements and fetching their rows.")
+METRICS.counter("app_db_rows_total", "Rows fetched (SELECT) or affected (writes).")
+METRICS.histogram("app_db_queries_per_scope", "Statements per request or job; a long tail means per-row queries.",
+                  QUERY_COUNT_BUCKETS)
+METRICS.counter("app_jobs_total", "Background jobs run, by kind and outcome.")
+METRICS.histogram("app_job_duration_seconds", "Background job run time.", LATENCY_BUCKETS)
+
+# Requests keep their scope in g (still reachable while stream_with_context
+# generators run); background jobs, which have no app context, use this
+_metrics_scope = contextvars.ContextVar("metrics_scope", default=None)
+
+
+class MetricsScope:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+
+
+def begin_metrics_scope(name):
+    scope = MetricsScope(name)
+    return scope, _metrics_scope.set(scope)
+
+
+def end_metrics_scope(scope, token=None):
+    if token is not None:
+        _metrics_scope.reset(token)
+    if not METRICS_ENABLED:
+        return
+    METRICS.observe("app_db_queries_per_scope", {"scope": scope.name}, scope.queries)
+    if scope.queries > REQUEST_QUERY_WARN:
+        logger.warning("%s ran %d queries (%.0f ms in the database)",
+                       scope.name, scope.queries, scope.db_seconds * 1000)
+
+
+def _statement_kind(sql):
+    word = sql.lstrip(" \t\r\n(").split(None, 1)[0].lower() if sql.strip() else ""
+    if word == "with":
+        return "select"
+    return word if word in ("select", "insert", "update", "delete") else "other"
+
+
+def _record_db(kind, seconds, queries=0, rows=0):
+    if not METRICS_ENABLED:
+        return
+    scope = _metrics_scope.get()
+    if scope is None and has_app_context():
+        scope = g.get("metrics_scope")
+    labels = {"scope": scope.name if scope else "other", "statement": kind}
+    if queries:
+        METRICS.inc("app_db_queries_total", labels, queries)
+    METRICS.inc("app_db_query_seconds_total", labels, seconds)
+    if rows > 0:
+        METRICS.inc("app_db_rows_total", labels, rows)
+    if scope is not None:
+        scope.queries += queries
+        scope.rows += max(rows, 0)
+        scope.db_seconds += seconds
+
+
+class _InstrumentedCursorMixin:
+    # execute() counts the statement and its affected rows; fetch*() counts rows read
+    _kind = "other"
+
+    def _timed_execute(self, method, sql, *args):
+        # psycopg2.extras.execute_values passes the statement as bytes
+        self._kind = _statement_kind(sql.decode(errors="replace") if isinstance(sql, bytes) else str(sql))
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            rows = self.rowcount if self._kind != "select" else 0
+            _record_db(self._kind, time.perf_counter() - start, queries=1, rows=rows)
+
+    def _timed_fetch(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        _record_db(self._kind, time.perf_counter() - start, rows=rows)
+        return result
+
+    def execute(self, sql, *args):
+        return self._timed_execute(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed_execute(super().executemany, sql, *args)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed_fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class InstrumentedSQLiteCursor(_InstrumentedCursorMixin, sqlite3.Cursor):
+    pass
+
+
+class InstrumentedSQLiteConnection(sqlite3.Connection):
+    # Still a sqlite3.Connection, so the isinstance() backend checks keep working
+    def cursor(self, factory=InstrumentedSQLiteCursor):
+        return super().cursor(factory)
+
+    # The C-level shortcuts don't go through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+class InstrumentedPGCursor(_InstrumentedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+def _profile_requested():
+    if PROFILE == "header":
+        return request.headers.get("X-Profile") == "1"
+    if PROFILE == "sample":
+        return random.random() < PROFILE_SAMPLE_RATE
+    return False
+
+
+_profile_lock = threading.Lock()
+
+
+def _start_profiler():
+    # pyinstrument when installed, cProfile otherwise; one profiled request at a time
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+        except ImportError:
+            import cProfile
+            profiler = cProfile.Profile()
+        if hasattr(profiler, "enable"):
+            profiler.enable()
+        else:
+            profiler.start()
+        return profiler
+    except Exception:
+        _profile_lock.release()
+        logger.exception("Could not start profiler")
+        return None
+
+
+def _stop_profiler(profiler, name):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{name}-{uuid.uuid4().hex[:6]}")
+        if hasattr(profiler, "output_html"):
+            profiler.stop()
+            path = stem + ".html"
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = stem + ".prof"
+            profiler.dump_stats(path)
+        logger.info("Profile written to %s", path)
+    except Exception:
+        logger.exception("Could not write profile")
+    finally:
+        _profile_lock.release()
+
+
+def _finish_request_metrics(scope, profiler, method, status):
+    if profiler is not None:
+        _stop_profiler(profiler, scope.name if scope else "request")
+    if scope is None:
+        return
+    end_metrics_scope(scope)
+    METRICS.inc("app_http_requests_total", {"endpoint": scope.name, "method": method, "status": status})
+    METRICS.observe("app_http_request_duration_seconds", {"endpoint": scope.name, "method": method},
+                    time.perf_counter() - scope.started)
+
+
+@app.before_request
+def start_request_metrics():
+    if METRICS_ENABLED:
+        g.metrics_scope = MetricsScope(request.endpoint or "unmatched")
+    if PROFILE != "off" and _profile_requested():
+        g.profiler = _start_profiler()
+
+
+@app.after_request
+def add_server_timing(response):
+    scope, profiler = g.get("metrics_scope"), g.get("profiler")
+    if scope is not None:
+        total = (time.perf_counter() - scope.started) * 1000
+        response.headers["Server-Timing"] = (
+            f'db;dur={scope.db_seconds * 1000:.1f};desc="{scope.queries} queries", app;dur={total:.1f}'
+        )
+    g.metrics_status = response.status_code
+    if (scope is not None or profiler is not None) and response.is_streamed:
+        # The request context is torn down before a streamed body is sent, so
+        # export/NDJSON responses are finished when the server closes them
+        g.metrics_deferred = True
+        method, status = request.method, response.status_code
+        response.call_on_close(lambda: _finish_request_metrics(scope, profiler, method, status))
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error):
+    if g.get("metrics_deferred"):
+        return
+    scope, profiler = g.pop("metrics_scope", None), g.pop("profiler", None)
+    if scope is not None or profiler is not None:
+        status = 500 if error is not None else g.get("metrics_status", 500)
+        _finish_request_metrics(scope, profiler, request.method, status)
+
+
+@app.route("/metrics")
+def metrics():
+    if not METRICS_ENABLED:
+        return ("Metrics are disabled.", 404)
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
 # 2️ Helper: placeholder match with database
 def get_placeholder(conn, count):
     if isinstance(conn, sqlite3.Connection):
@@ -56,11 +504,140 @@ def get_placeholder(conn, count):
         return ",".join(["%s"] * count)
 
 
-# 3️ Initialize a database 
-def init_db():
-    conn = get_connection()
+# Helper: batched multi-row INSERT. rows may be any iterable (consumed in
+# chunks of BULK_INSERT_BATCH); does not commit.
+BULK_INSERT_BATCH = 1000
+
+
+def bulk_insert(conn, table_name, columns, rows):
     c = conn.cursor()
+    sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BULK_INSERT_BATCH:
+            total += _insert_batch(conn, c, sql, columns, batch)
+            batch = []
+    if batch:
+        total += _insert_batch(conn, c, sql, columns, batch)
+    return total
+
+
+def _insert_batch(conn, c, sql, columns, batch):
+    if isinstance(conn, sqlite3.Connection):
+        c.executemany(sql + f"({get_placeholder(conn, len(columns))})", batch)
+    else:
+        psycopg2.extras.execute_values(c, sql + "%s", batch, page_size=len(batch))
+    return len(batch)
+
+
+# --- Competency registry ---
+# The one list of competencies, in column order. Each has a score column <key>
+# and a requirement column <key>_req (1.0-5.0); its group decides how it counts:
+#   core     - pct_core for every title
+#   premium  - pct_core, but CLASSIFICATION_RESTRICTED_TITLES must leave it empty
+#   new      - pct_new for every title
+# Validation, inserts, classification and the form / detail templates all work
+# from the lists derived here.
+Competency = namedtuple("Competency", ["key", "label", "group"])
+COMPETENCIES = (
+    Competency("communication", "Communication", "core"),
+    Competency("continuous_learning", "Continuous Learning", "core"),
+    Competency("critical_thinking", "Critical Thinking", "core"),
+    Competency("data_analysis", "Data Analysis", "core"),
+    Competency("digital_literacy", "Digital Literacy", "core"),
+    Competency("problem_solving", "Problem Solving", "core"),
+    Competency("strategic_thinking", "Strategic Thinking", "premium"),
+    Competency("talent_management", "Talent Management", "premium"),
+    Competency("teamwork_leadership", "Teamwork & Leadership", "premium"),
+    Competency("creative_thinking", "Creative Thinking", "new"),
+    Competency("resilience", "Resilience", "new"),
+    Competency("ai_bigdata", "AI & Big Data", "new"),
+    Competency("analytical_thinking", "Analytical Thinking", "new"),
+)
+CLASSIFICATION_RESTRICTED_TITLES = ("Officer", "Senior")
+
+
+def competency_keys(*groups):
+    return tuple(comp.key for comp in COMPETENCIES if comp.group in groups)
+
+
+CLASSIFICATION_RESTRICTED_KEYS = competency_keys("core")          # pct_core for Officer/Senior
+CLASSIFICATION_PREMIUM_KEYS = competency_keys("premium")
+CLASSIFICATION_CORE_KEYS = competency_keys("core", "premium")    # pct_core for everyone else
+CLASSIFICATION_NEW_KEYS = competency_keys("new")
+
+# Fields a user supplies for one employee (form, upload, bulk API). Scores are
+# stored as: core scores, core requirements, new scores, new requirements.
+EMPLOYEE_TEXT_FIELDS = ["year", "code", "full_name", "title", "department", "division"]
+EMPLOYEE_SCORE_FIELDS = [k + suffix for keys in (CLASSIFICATION_CORE_KEYS, CLASSIFICATION_NEW_KEYS)
+                         for suffix in ("", "_req") for k in keys]
+EMPLOYEE_INPUT_FIELDS = EMPLOYEE_TEXT_FIELDS + EMPLOYEE_SCORE_FIELDS
+
+# One employee as a tuple in EMPLOYEE_INPUT_FIELDS order instead of a dict:
+# validation returns it, staging stores it as a JSON list and inserts bind it
+# as is. FIELD_INDEX gives a field's position for the hot loops.
+EmployeeRecord = namedtuple("EmployeeRecord", EMPLOYEE_INPUT_FIELDS)
+FIELD_INDEX = {k: i for i, k in enumerate(EMPLOYEE_INPUT_FIELDS)}
+
+
+def _field_pairs(keys):
+    # (score position, requirement position) per competency
+    return tuple((FIELD_INDEX[k], FIELD_INDEX[k + "_req"]) for k in keys)
+
+
+_TITLE_AT = FIELD_INDEX["title"]
+_RESTRICTED_AT = _field_pairs(CLASSIFICATION_RESTRICTED_KEYS)
+_PREMIUM_AT = _field_pairs(CLASSIFICATION_PREMIUM_KEYS)
+_CORE_AT = _field_pairs(CLASSIFICATION_CORE_KEYS)
+_NEW_AT = _field_pairs(CLASSIFICATION_NEW_KEYS)
+
+
+@app.context_processor
+def inject_competencies():
+    return {"competencies": COMPETENCIES, "restricted_titles": CLASSIFICATION_RESTRICTED_TITLES}
+
+
+# Helper: sync columns for new employee rows. SQLite's created_at default only
+# has whole seconds, so stamp updated_at to the millisecond like the touch
+# trigger does, and take the next change_seq (migration 011); bumping the
+# counter also takes the write lock, so the value is in commit order. On
+# Postgres both come from triggers.
+def insert_stamp(conn):
+    # (extra columns, extra values) to append to an employee INSERT
+    if isinstance(conn, sqlite3.Connection):
+        c = conn.cursor()
+        c.execute("UPDATE employee_sync SET seq = seq + 1 WHERE id = 1")
+        c.execute("SELECT seq FROM employee_sync WHERE id = 1")
+        return ["updated_at", "change_seq"], (
+            datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], c.fetchone()[0]
+        )
+    return [], ()
+
+
+# 3️ Initialize a database: versioned migrations
+# Each migration runs once per database, in version order, inside its own
+# transaction; applied versions are recorded in schema_migrations. Concurrent
+# workers serialise on BEGIN IMMEDIATE (SQLite) / an advisory lock (Postgres).
+MIGRATION_LOCK_KEY = 804_201
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+class MigrationDeferred(MigrationError):
+    # The data is not ready for this migration yet. run_migrations logs it and
+    # carries on with the rest, so the app keeps serving (incl. the pages needed
+    # to fix the data); it is retried on the next start and flask init-db fails on it.
+    pass
+
+
+deferred_migrations = {}  # version -> reason, for this process
+
 
+def _migration_001_employee(conn, c):
     id_type = "INTEGER PRIMARY KEY AUTOINCREMENT" if isinstance(conn, sqlite3.Connection) else "SERIAL PRIMARY KEY"
     c.execute(f"""
     CREATE TABLE IF NOT EXISTS employee (
@@ -97,232 +674,1715 @@ def init_db():
         ai_bigdata REAL,
         analytical_thinking REAL,
 
-        creative_thinking_req REAL,
-        resilience_req REAL,
-        ai_bigdata_req REAL,
-        analytical_thinking_req REAL,
+        creative_thinking_req REAL,
+        resilience_req REAL,
+        ai_bigdata_req REAL,
+        analytical_thinking_req REAL,
+
+        classification_core TEXT,
+        classification_new TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def _migration_002_upload_log(conn, c):
+    id_type = "INTEGER PRIMARY KEY AUTOINCREMENT" if isinstance(conn, sqlite3.Connection) else "SERIAL PRIMARY KEY"
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS upload_log (
+        id {id_type},
+        filename TEXT, handler TEXT, note TEXT,
+        uploaded_records INTEGER, skipped_records INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def _migration_003_unique_code_year(conn, c):
+    c.execute("""
+        SELECT LOWER(code), year, COUNT(*) FROM employee
+        GROUP BY LOWER(code), year HAVING COUNT(*) > 1
+    """)
+    duplicates = c.fetchall()
+    if duplicates:
+        sample = ", ".join(f"{code}/{year}" for code, year, _ in duplicates[:10])
+        raise MigrationDeferred(
+            f"{len(duplicates)} duplicate (code, year) pairs must be removed before the "
+            f"unique index can be created, e.g. {sample}"
+        )
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS employee_code_year_uniq ON employee (LOWER(code), year)")
+
+
+def _migration_004_sort_indexes(conn, c):
+    # Match the keyset expressions used by fetch_employee_page
+    for col in ["year", "code", "full_name", "department", "division"]:
+        c.execute(f"CREATE INDEX IF NOT EXISTS employee_{col}_sort ON employee (COALESCE({col}, ''), id)")
+    c.execute("CREATE INDEX IF NOT EXISTS employee_created_at_sort ON employee (created_at, id)")
+
+
+def _migration_005_search_index(conn, c):
+    # SQLite: FTS5 external-content table with the trigram tokenizer (substring
+    # matches like LIKE '%term%', but indexed), kept in sync by triggers.
+    # Postgres: pg_trgm GIN indexes, which ILIKE '%term%' and similarity() use.
+    # Either may be unavailable; search then falls back to LIKE/ILIKE.
+    cols = ", ".join(SEARCH_COLUMNS)
+    new_cols = ", ".join(f"new.{k}" for k in SEARCH_COLUMNS)
+    old_cols = ", ".join(f"old.{k}" for k in SEARCH_COLUMNS)
+
+    if isinstance(conn, sqlite3.Connection):
+        try:
+            c.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS employee_fts USING fts5(
+                {cols}, content='employee', content_rowid='id', tokenize='trigram'
+            )
+            """)
+        except sqlite3.OperationalError as e:
+            # FTS5 or the trigram tokenizer (SQLite >= 3.34) is missing
+            logger.warning("SQLite full-text search unavailable, search will use LIKE: %s", e)
+            return
+
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employee_fts_ai AFTER INSERT ON employee BEGIN
+            INSERT INTO employee_fts (rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+        """)
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employee_fts_ad AFTER DELETE ON employee BEGIN
+            INSERT INTO employee_fts (employee_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        END
+        """)
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employee_fts_au AFTER UPDATE OF {cols} ON employee BEGIN
+            INSERT INTO employee_fts (employee_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            INSERT INTO employee_fts (rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+        """)
+        # Index rows that were there before the FTS table
+        c.execute("INSERT INTO employee_fts (employee_fts) VALUES ('rebuild')")
+    else:
+        c.execute("SAVEPOINT search_index")
+        try:
+            c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for k in SEARCH_COLUMNS:
+                c.execute(f"CREATE INDEX IF NOT EXISTS employee_{k}_trgm ON employee USING gin ({k} gin_trgm_ops)")
+            c.execute("RELEASE SAVEPOINT search_index")
+        except psycopg2.Error as e:
+            logger.warning("pg_trgm unavailable, search will use ILIKE: %s", e)
+            c.execute("ROLLBACK TO SAVEPOINT search_index")
+
+
+def _create_sqlite_touch_trigger(c):
+    # Millisecond precision, so rows changed in the same second as a sync are not skipped
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS employee_touch_updated_at AFTER UPDATE ON employee
+    WHEN NEW.updated_at IS OLD.updated_at BEGIN
+        UPDATE employee SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+    END
+    """)
+
+
+def _migration_006_updated_at(conn, c):
+    # Last-modified time for incremental sync. Inserts leave it NULL (SQLite can't
+    # add a column with a CURRENT_TIMESTAMP default), so readers use
+    # COALESCE(updated_at, created_at); a trigger stamps every UPDATE.
+    if isinstance(conn, sqlite3.Connection):
+        c.execute("ALTER TABLE employee ADD COLUMN updated_at TIMESTAMP")
+        _create_sqlite_touch_trigger(c)
+    else:
+        c.execute("ALTER TABLE employee ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP")
+        c.execute("""
+        CREATE OR REPLACE FUNCTION employee_touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = CURRENT_TIMESTAMP;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+        c.execute("DROP TRIGGER IF EXISTS employee_touch_updated_at ON employee")
+        c.execute("""
+        CREATE TRIGGER employee_touch_updated_at BEFORE UPDATE ON employee
+        FOR EACH ROW EXECUTE PROCEDURE employee_touch_updated_at()
+        """)
+    c.execute("CREATE INDEX IF NOT EXISTS employee_modified_sync ON employee (COALESCE(updated_at, created_at), id)")
+
+
+def _migration_007_employee_summary(conn, c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS employee_summary (
+        year TEXT NOT NULL,
+        division TEXT NOT NULL,
+        department TEXT NOT NULL,
+        classification_core TEXT NOT NULL,
+        classification_new TEXT NOT NULL,
+        employees INTEGER NOT NULL,
+        pct_core_sum REAL,
+        pct_core_count INTEGER NOT NULL,
+        pct_new_sum REAL,
+        pct_new_count INTEGER NOT NULL,
+        PRIMARY KEY (year, division, department, classification_core, classification_new)
+    )
+    """)
+    # Filled by migration 008 once pct_core / pct_new exist, then kept current by reclassify_all
+
+
+def _migration_008_pct_columns(conn, c):
+    # Stored pct_core / pct_new (see record_pct). The app fills them on insert;
+    # a trigger recomputes them when scores or title change.
+    # Doubles like the computed values (REAL is 8 bytes on SQLite, 4 on Postgres)
+    pct_type = "REAL" if isinstance(conn, sqlite3.Connection) else "DOUBLE PRECISION"
+    pct_core, pct_new = employee_pct_sql()
+    c.execute(f"ALTER TABLE employee ADD COLUMN pct_core {pct_type}")
+    c.execute(f"ALTER TABLE employee ADD COLUMN pct_new {pct_type}")
+
+    # Backfill without stamping updated_at on every row
+    score_cols = ", ".join(["title"] + [k for key in CLASSIFICATION_CORE_KEYS + CLASSIFICATION_NEW_KEYS
+                                        for k in (key, key + "_req")])
+    if isinstance(conn, sqlite3.Connection):
+        c.execute("DROP TRIGGER IF EXISTS employee_touch_updated_at")
+        c.execute(f"UPDATE employee SET pct_core = {pct_core}, pct_new = {pct_new}")
+        _create_sqlite_touch_trigger(c)
+
+        new_core, new_new = employee_pct_sql("NEW.")
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS employee_pct_au AFTER UPDATE OF {score_cols} ON employee BEGIN
+            UPDATE employee SET pct_core = {new_core}, pct_new = {new_new} WHERE id = NEW.id;
+        END
+        """)
+    else:
+        c.execute("ALTER TABLE employee DISABLE TRIGGER employee_touch_updated_at")
+        c.execute(f"UPDATE employee SET pct_core = {pct_core}, pct_new = {pct_new}")
+        c.execute("ALTER TABLE employee ENABLE TRIGGER employee_touch_updated_at")
+
+        new_core, new_new = employee_pct_sql("NEW.")
+        c.execute(f"""
+        CREATE OR REPLACE FUNCTION employee_update_pct() RETURNS trigger AS $$
+        BEGIN
+            NEW.pct_core = {new_core};
+            NEW.pct_new = {new_new};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+        c.execute("DROP TRIGGER IF EXISTS employee_update_pct ON employee")
+        c.execute(f"""
+        CREATE TRIGGER employee_update_pct BEFORE UPDATE OF {score_cols} ON employee
+        FOR EACH ROW EXECUTE PROCEDURE employee_update_pct()
+        """)
+
+    for col in ["pct_core", "pct_new"]:
+        c.execute(f"CREATE INDEX IF NOT EXISTS employee_{col}_sort ON employee (COALESCE({col}, -1), id)")
+    refresh_employee_summary(conn, "employee")
+
+
+def _migration_009_pct_double_precision(conn, c):
+    # Postgres databases that ran 008 before it used DOUBLE PRECISION hold
+    # float4 pct values; widen them, recompute from the scores and relabel so
+    # thresholds compare the same values the app computes. No-op on SQLite.
+    if isinstance(conn, sqlite3.Connection):
+        return
+    for table, columns in (("employee", ["pct_core", "pct_new"]),
+                           ("employee_summary", ["pct_core_sum", "pct_new_sum"])):
+        for col in columns:
+            c.execute(f"ALTER TABLE {table} ALTER COLUMN {col} TYPE DOUBLE PRECISION")
+
+    pct_core, pct_new = employee_pct_sql()
+    c.execute("ALTER TABLE employee DISABLE TRIGGER employee_touch_updated_at")
+    c.execute(f"UPDATE employee SET pct_core = {pct_core}, pct_new = {pct_new}")
+    c.execute("ALTER TABLE employee ENABLE TRIGGER employee_touch_updated_at")
+    reclassify_all(conn, "employee")
+
+
+def _migration_010_app_state(conn, c):
+    # Small key/value store for facts about the data, e.g. which
+    # CLASSIFICATION_PARTITION the stored labels were computed with
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS app_state (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+
+def _migration_011_change_seq(conn, c):
+    # Sync watermark that follows commit order. updated_at is taken when a row
+    # is written, not when it commits, so a client pulling updated_after=T can
+    # miss a slow transaction that stamped T-1 and committed later. change_seq
+    # comes from a one-row counter that every writing transaction bumps and
+    # holds (SQLite's write lock / the counter row lock on Postgres) until it
+    # commits, so anything committed after a pull gets a higher value.
+    if isinstance(conn, sqlite3.Connection):
+        c.execute("ALTER TABLE employee ADD COLUMN change_seq INTEGER")
+        c.execute("CREATE TABLE IF NOT EXISTS employee_sync (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL)")
+        c.execute("DROP TRIGGER IF EXISTS employee_touch_updated_at")
+        c.execute("UPDATE employee SET change_seq = id")
+        c.execute("INSERT INTO employee_sync (id, seq) SELECT 1, COALESCE(MAX(id), 0) FROM employee")
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS employee_touch_updated_at AFTER UPDATE ON employee
+        WHEN NEW.updated_at IS OLD.updated_at BEGIN
+            UPDATE employee_sync SET seq = seq + 1 WHERE id = 1;
+            UPDATE employee SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                change_seq = (SELECT seq FROM employee_sync WHERE id = 1)
+            WHERE id = NEW.id;
+        END
+        """)
+        # Inserts that don't go through insert_stamp
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS employee_change_seq_ai AFTER INSERT ON employee
+        WHEN NEW.change_seq IS NULL BEGIN
+            UPDATE employee_sync SET seq = seq + 1 WHERE id = 1;
+            UPDATE employee SET change_seq = (SELECT seq FROM employee_sync WHERE id = 1) WHERE id = NEW.id;
+        END
+        """)
+    else:
+        c.execute("ALTER TABLE employee ADD COLUMN IF NOT EXISTS change_seq BIGINT")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS employee_sync (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq BIGINT NOT NULL,
+            txid BIGINT
+        )
+        """)
+        c.execute("ALTER TABLE employee DISABLE TRIGGER employee_touch_updated_at")
+        c.execute("UPDATE employee SET change_seq = id")
+        c.execute("ALTER TABLE employee ENABLE TRIGGER employee_touch_updated_at")
+        c.execute("""
+        INSERT INTO employee_sync (id, seq) SELECT 1, COALESCE(MAX(id), 0) FROM employee
+        ON CONFLICT (id) DO NOTHING
+        """)
+        # The first write of a transaction takes the next value and keeps the
+        # counter row locked until commit; later writes in it reuse the value
+        c.execute("""
+        CREATE OR REPLACE FUNCTION employee_set_change_seq() RETURNS trigger AS $$
+        DECLARE next_seq BIGINT;
+        BEGIN
+            UPDATE employee_sync SET seq = seq + 1, txid = txid_current()
+            WHERE id = 1 AND txid IS DISTINCT FROM txid_current()
+            RETURNING seq INTO next_seq;
+            IF next_seq IS NULL THEN
+                SELECT seq INTO next_seq FROM employee_sync WHERE id = 1;
+            END IF;
+            NEW.change_seq = next_seq;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+        c.execute("DROP TRIGGER IF EXISTS employee_set_change_seq ON employee")
+        c.execute("""
+        CREATE TRIGGER employee_set_change_seq BEFORE INSERT OR UPDATE ON employee
+        FOR EACH ROW EXECUTE PROCEDURE employee_set_change_seq()
+        """)
+    c.execute("CREATE INDEX IF NOT EXISTS employee_change_seq ON employee (change_seq)")
+
+
+def _migration_012_score_double_precision(conn, c):
+    # Score columns were REAL (float4) on Postgres, so the SQL pct (trigger,
+    # migration 009) used rounded scores while record_pct used the submitted
+    # ones, and the same row could get a different pct depending on the path
+    # that wrote it. Widen them through numeric, which gives back the decimal
+    # that was entered (3.3, not 3.2999999523), then recompute pct and relabel.
+    # No-op on SQLite, where REAL is already a double.
+    if isinstance(conn, sqlite3.Connection):
+        return
+    for col in EMPLOYEE_SCORE_FIELDS:
+        c.execute(f"ALTER TABLE employee ALTER COLUMN {col} TYPE DOUBLE PRECISION USING {col}::numeric")
+
+    pct_core, pct_new = employee_pct_sql()
+    c.execute("ALTER TABLE employee DISABLE TRIGGER employee_touch_updated_at")
+    c.execute(f"UPDATE employee SET pct_core = {pct_core}, pct_new = {pct_new}")
+    c.execute("ALTER TABLE employee ENABLE TRIGGER employee_touch_updated_at")
+    reclassify_all(conn, "employee")
+
+
+def _migration_013_more_sort_indexes(conn, c):
+    # The remaining text sort keys, same keyset expressions as migration 004
+    for col in ["title", "classification_core", "classification_new"]:
+        c.execute(f"CREATE INDEX IF NOT EXISTS employee_{col}_sort ON employee (COALESCE({col}, ''), id)")
+
+
+MIGRATIONS = [
+    (1, "employee table", _migration_001_employee),
+    (2, "upload_log table", _migration_002_upload_log),
+    (3, "unique index on (lower(code), year)", _migration_003_unique_code_year),
+    (4, "indexes for sort columns", _migration_004_sort_indexes),
+    (5, "full-text / trigram search index", _migration_005_search_index),
+    (6, "updated_at column for incremental sync", _migration_006_updated_at),
+    (7, "employee_summary rollup table", _migration_007_employee_summary),
+    (8, "stored pct_core / pct_new columns", _migration_008_pct_columns),
+    (9, "double precision pct columns on Postgres", _migration_009_pct_double_precision),
+    (10, "app_state table", _migration_010_app_state),
+    (11, "change_seq column for incremental sync", _migration_011_change_seq),
+    (12, "double precision score columns on Postgres", _migration_012_score_double_precision),
+    (13, "indexes for title / classification sort columns", _migration_013_more_sort_indexes),
+]
+
+
+def _begin_migration(conn, c):
+    if isinstance(conn, sqlite3.Connection):
+        c.execute("BEGIN IMMEDIATE")
+    else:
+        c.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+
+
+def run_migrations(conn):
+    c = conn.cursor()
+    ph = get_placeholder(conn, 1)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+
+    c.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in c.fetchall()}
+    newly_applied = []
+
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        _begin_migration(conn, c)
+        try:
+            # Another worker may have applied it while we waited for the lock
+            c.execute(f"SELECT 1 FROM schema_migrations WHERE version = {ph}", (version,))
+            if c.fetchone():
+                conn.commit()
+                continue
+            logger.info("Applying migration %03d: %s", version, description)
+            migrate(conn, c)
+            c.execute(
+                f"INSERT INTO schema_migrations (version, description) VALUES ({get_placeholder(conn, 2)})",
+                (version, description)
+            )
+            conn.commit()
+            newly_applied.append(version)
+            deferred_migrations.pop(version, None)
+        except MigrationDeferred as e:
+            conn.rollback()
+            deferred_migrations[version] = str(e)
+            logger.error("Migration %03d (%s) skipped: %s", version, description, e)
+        except Exception:
+            conn.rollback()
+            raise
+    return newly_applied
+
+
+def init_db(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        applied = run_migrations(conn)
+        detect_search_backend(conn)
+    finally:
+        if own_conn:
+            conn.close()
+    return applied
+
+
+# --- Search ---
+SEARCH_COLUMNS = ["full_name", "code", "division", "department"]
+SEARCH_MIN_TRIGRAM = 3  # shorter terms can't use a trigram index
+search_backend = "like"
+
+
+def detect_search_backend(conn):
+    global search_backend
+    c = conn.cursor()
+    if isinstance(conn, sqlite3.Connection):
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employee_fts'")
+        search_backend = "fts5" if c.fetchone() else "like"
+    else:
+        c.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        search_backend = "pg_trgm" if c.fetchone() else "like"
+        conn.commit()
+    return search_backend
+
+
+def build_search_source(conn, table_name, search):
+    # Returns (FROM clause, params) for a derived table of matching employees
+    # with a "rank" column; lower rank = more relevant.
+    like = f"%{search}%"
+    if isinstance(conn, sqlite3.Connection):
+        if search_backend == "fts5" and len(search) >= SEARCH_MIN_TRIGRAM:
+            phrase = '"' + search.replace('"', '""') + '"'
+            return (
+                f"(SELECT e.*, bm25(employee_fts) AS rank FROM employee_fts "
+                f"JOIN {table_name} e ON e.id = employee_fts.rowid "
+                f"WHERE employee_fts MATCH ?) AS t",
+                (phrase,)
+            )
+        # No relevance to rank by: newest first, like the unsearched list
+        where = " OR ".join(f"{k} LIKE ?" for k in SEARCH_COLUMNS)
+        return f"(SELECT *, -id AS rank FROM {table_name} WHERE {where}) AS t", (like,) * len(SEARCH_COLUMNS)
+
+    where = " OR ".join(f"{k} ILIKE %s" for k in SEARCH_COLUMNS)
+    if search_backend == "pg_trgm":
+        # Substring hits plus fuzzy (trigram-similar) names, best match first
+        similarity = ", ".join(f"similarity(COALESCE({k}, ''), %s)" for k in SEARCH_COLUMNS)
+        return (
+            f"(SELECT e.*, -GREATEST({similarity}) AS rank FROM {table_name} e "
+            f"WHERE {where} OR full_name %% %s) AS t",
+            (search,) * len(SEARCH_COLUMNS) + (like,) * len(SEARCH_COLUMNS) + (search,)
+        )
+    return f"(SELECT *, -id AS rank FROM {table_name} WHERE {where}) AS t", (like,) * len(SEARCH_COLUMNS)
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def ensure_schema(conn):
+    # Runs init_db once per process instead of DDL on every request
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        init_db(conn)
+        _schema_ready = True
+    # Outside the lock: with JOB_RUNNER=inline the job runs here and calls ensure_schema
+    check_classification_partition(conn)
+
+
+def check_classification_partition(conn):
+    # Labels are only comparable within one partitioning. When
+    # CLASSIFICATION_PARTITION differs from the one recorded in app_state (or
+    # nothing is recorded yet: a database labelled with global thresholds),
+    # queue one full reclassification. Exactly one worker wins the update.
+    c = conn.cursor()
+    ph = get_placeholder(conn, 1)
+    current = ",".join(CLASSIFICATION_PARTITION)
+    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+    _begin_migration(conn, c)
+    try:
+        c.execute(f"SELECT value FROM app_state WHERE name = {ph}", ("classification_partition",))
+        row = c.fetchone()
+        if row is not None and row[0] == current:
+            conn.commit()
+            return False
+        if row is None:
+            c.execute(f"INSERT INTO app_state (name, value) VALUES ({get_placeholder(conn, 2)})",
+                      ("classification_partition", current))
+        else:
+            c.execute(f"UPDATE app_state SET value = {ph} WHERE name = {ph}", (current, "classification_partition"))
+        c.execute(f"SELECT 1 FROM {table_name} LIMIT 1")
+        has_rows = c.fetchone() is not None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if has_rows:
+        logger.info("Classification partition is now '%s' (was '%s'); queued a full reclassification",
+                    current, row[0] if row else "unrecorded")
+        enqueue_job("reclassify", {})
+    return has_rows
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    applied = init_db()
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    for version, reason in sorted(deferred_migrations.items()):
+        print(f"Migration {version:03d} skipped: {reason}")
+    if deferred_migrations:
+        raise SystemExit(1)
+    if not applied:
+        print("Database schema is up to date.")
+
+
+# --- Response cache ---
+# Read-through cache for /employees, /detail and /api/employees. Keys embed a
+# generation counter that every write bumps (bump_cache_generation), so entries
+# built from older data are never read again. CACHE_BACKEND:
+#   memory - per-process LRU with TTL (default). Only for a single worker: a
+#            write in one process does not bump the others, which keep serving
+#            their entries until CACHE_TTL. Use sqlite with several workers or
+#            an external job runner.
+#   sqlite - one cache file (CACHE_DB_PATH) shared by all workers on the host
+#   none   - disabled
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_DB_PATH = os.path.abspath(os.getenv("CACHE_DB_PATH", "cache.db"))
+
+
+class MemoryCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Random start, so keys from another process or before a restart never match
+        self._generation = random.getrandbits(48)
+        self._lock = threading.Lock()
+
+    def generation(self):
+        return self._generation
+
+    def bump(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    # Values are pickled; when full, the entries closest to expiry are evicted first
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('generation', 0)")
+            conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def generation(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT value FROM cache_meta WHERE name = 'generation'").fetchone()[0]
+
+    def bump(self):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE cache_meta SET value = value + 1 WHERE name = 'generation'")
+            conn.execute("DELETE FROM cache_entries")
+            conn.commit()
+
+    def get(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value, expires FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)",
+                         (key, pickle.dumps(value), now + self.ttl))
+            conn.execute("DELETE FROM cache_entries WHERE expires < ?", (now,))
+            conn.execute("""
+                DELETE FROM cache_entries WHERE key IN (
+                    SELECT key FROM cache_entries ORDER BY expires DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # None when caching is disabled
+    global _cache
+    if _cache is None and CACHE_BACKEND != "none":
+        with _cache_lock:
+            if _cache is None:
+                if CACHE_BACKEND == "sqlite":
+                    _cache = SQLiteCache(CACHE_DB_PATH, CACHE_MAX_ENTRIES, CACHE_TTL)
+                elif CACHE_BACKEND == "memory":
+                    _cache = MemoryCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+                else:
+                    raise ValueError(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}'")
+    return _cache
+
+
+def cache_key(name, args=None):
+    # Query args are sorted so ?a=1&b=2 and ?b=2&a=1 share an entry
+    if args is None:
+        return name
+    return name + "?" + "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+
+
+def cached(key, loader, generation=None):
+    # Read-through: loader() runs on a miss and its result (unless None) is stored.
+    # The generation is read before loading, so a result computed while a write
+    # is committing is filed under the old generation and never served.
+    cache = get_cache()
+    if cache is None:
+        return loader()
+    if generation is None:
+        generation = cache.generation()
+    key = f"{generation}:{key}"
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+def bump_cache_generation():
+    # Call after every commit that changes employee data
+    cache = get_cache()
+    if cache is not None:
+        cache.bump()
+
+
+# 4️ ROUTES
+@app.route("/")
+def index():
+    # Cookies from before drafts moved server-side may still carry the whole form
+    form_data = session.pop("form_data", None)
+    form_data = load_draft(session.get("draft_id")) or form_data
+    if not FORM_DRAFT_SYNC:
+        # One-shot refill; the page copies it into localStorage from here on
+        discard_draft(session.pop("draft_id", None))
+    return render_template("form.html", form_data=form_data, draft_sync=FORM_DRAFT_SYNC)
+
+# --- Employee listing: keyset pagination ---
+EMPLOYEE_PAGE_SIZE = int(os.getenv("EMPLOYEE_PAGE_SIZE", "50"))
+EMPLOYEE_MAX_PAGE_SIZE = int(os.getenv("EMPLOYEE_MAX_PAGE_SIZE", "500"))
+
+EMPLOYEE_COLUMNS = ["id", *EMPLOYEE_INPUT_FIELDS,
+                    "classification_core", "classification_new", "created_at", "pct_core", "pct_new"]
+# Columns rendered by employees.html
+EMPLOYEE_LIST_COLUMNS = [
+    "id", "year", "code", "full_name", "title", "department", "division",
+    "created_at", "classification_core", "classification_new"
+]
+EMPLOYEE_SORT_COLUMNS = [
+    "id", "year", "code", "full_name", "title", "department", "division",
+    "created_at", "classification_core", "classification_new", "pct_core", "pct_new"
+]
+# Nullable columns are compared through COALESCE so NULLs don't fall out of the
+# keyset: '' for text, -1 for the pct scores (which are never negative)
+EMPLOYEE_NOT_NULL_SORT = {"id", "created_at", "rank"}
+EMPLOYEE_NUMERIC_SORT = {"pct_core", "pct_new"}
+# ?pct_core_min=80&pct_new_max=120 style range filters
+EMPLOYEE_RANGE_FILTERS = ["pct_core", "pct_new"]
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(sort_value, emp_id):
+    raw = json.dumps([sort_value, emp_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, emp_id = json.loads(raw)
+        return sort_value, int(emp_id)
+    except Exception:
+        raise PaginationError("Invalid cursor")
+
+
+def parse_page_args(args, default_columns=None, searching=False):
+    # Reads limit / sort / order / cursor / fields from a request's query string.
+    # Search results default to relevance order ("rank").
+    try:
+        limit = int(args.get("limit", EMPLOYEE_PAGE_SIZE))
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    limit = max(1, min(limit, EMPLOYEE_MAX_PAGE_SIZE))
+
+    sort = args.get("sort") or ("rank" if searching else "id")
+    if sort not in EMPLOYEE_SORT_COLUMNS and not (searching and sort == "rank"):
+        raise PaginationError(f"Cannot sort by '{sort}'")
+
+    order = (args.get("order") or ("asc" if sort == "rank" else "desc")).lower()
+    if order not in ("asc", "desc"):
+        raise PaginationError("order must be 'asc' or 'desc'")
+
+    columns = default_columns or EMPLOYEE_COLUMNS
+    if args.get("fields"):
+        columns = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = [f for f in columns if f not in EMPLOYEE_COLUMNS]
+        if unknown:
+            raise PaginationError(f"Unknown fields: {', '.join(unknown)}")
+
+    filters = []
+    for col in EMPLOYEE_RANGE_FILTERS:
+        for suffix, op in (("_min", ">="), ("_max", "<=")):
+            if args.get(col + suffix):
+                try:
+                    filters.append((col, op, float(args[col + suffix])))
+                except ValueError:
+                    raise PaginationError(f"{col + suffix} must be a number")
+
+    cursor = args.get("cursor") or None
+    return {
+        "limit": limit,
+        "sort": sort,
+        "order": order,
+        "columns": columns,
+        "filters": filters,
+        "cursor": decode_cursor(cursor) if cursor else None,
+    }
+
+
+def range_conditions(conn, filters):
+    # (col, op, value) filters from parse_page_args -> SQL conditions and params
+    ph = "?" if isinstance(conn, sqlite3.Connection) else "%s"
+    return [f"{col} {op} {ph}" for col, op, _ in filters], [value for _, _, value in filters]
+
+
+def fetch_employee_page(conn, source, limit, sort="id", order="desc", columns=None,
+                        cursor=None, params=(), filters=()):
+    # One page of employees ordered by (sort, id). source is the table name or a
+    # derived table from build_search_source (its params go in params).
+    # Returns (rows as dicts, next_cursor or None).
+    ph = "?" if isinstance(conn, sqlite3.Connection) else "%s"
+    columns = list(columns or EMPLOYEE_COLUMNS)
+    select_cols = list(dict.fromkeys(["id", sort] + columns))
+
+    if sort in EMPLOYEE_NOT_NULL_SORT:
+        sort_expr = sort
+    elif sort in EMPLOYEE_NUMERIC_SORT:
+        sort_expr = f"COALESCE({sort}, -1)"
+    else:
+        sort_expr = f"COALESCE({sort}, '')"
+    op = "<" if order == "desc" else ">"
+
+    conditions, filter_params = range_conditions(conn, filters)
+    params = list(params) + filter_params
+    if cursor is not None:
+        sort_value, last_id = cursor
+        if sort == "id":
+            conditions.append(f"id {op} {ph}")
+            params.append(last_id)
+        else:
+            conditions.append(f"({sort_expr}, id) {op} ({ph}, {ph})")
+            params.extend([sort_value, last_id])
+
+    query = f"SELECT {', '.join(select_cols)} FROM {source}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if sort == "id":
+        query += f" ORDER BY id {order.upper()}"
+    else:
+        query += f" ORDER BY {sort_expr} {order.upper()}, id {order.upper()}"
+    query += f" LIMIT {int(limit) + 1}"
+
+    c = conn.cursor()
+    c.execute(query, params)
+    fetched = c.fetchall()
+
+    has_more = len(fetched) > limit
+    fetched = fetched[:limit]
+    rows = [dict(zip(select_cols, r)) for r in fetched]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        sort_value = last[sort]
+        if sort not in EMPLOYEE_NOT_NULL_SORT and sort_value is None:
+            sort_value = -1 if sort in EMPLOYEE_NUMERIC_SORT else ""
+        next_cursor = encode_cursor(sort_value, last["id"])
+
+    return [{k: r[k] for k in columns} for r in rows], next_cursor
+
+
+# --- Employee List + Search Icon ---
+@app.route("/employees")
+def employees():
+    search = request.args.get("search", "").strip()
+    try:
+        page = parse_page_args(request.args, EMPLOYEE_LIST_COLUMNS, searching=bool(search))
+    except PaginationError as e:
+        flash(str(e), "warning")
+        return redirect(url_for("employees"))
+
+    def load():
+        conn = get_db()
+
+        # PostgreSQL need schema to "public."
+        table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+
+        source, params = table_name, ()
+        if search:
+            source, params = build_search_source(conn, table_name, search)
+
+        return fetch_employee_page(
+            conn, source, page["limit"], page["sort"], page["order"], page["columns"],
+            page["cursor"], params, page["filters"]
+        )
+
+    rows, next_cursor = cached(cache_key("employees", request.args), load)
+
+    return render_template("employees.html", rows=rows, search=search, next_cursor=next_cursor,
+                           sort=page["sort"], order=page["order"], limit=page["limit"],
+                           is_first_page=page["cursor"] is None)
+
+# --- \Add member ---
+EMPLOYEE_REQUIRED_FIELDS = ["year", "code", "full_name"]
+
+
+def validate_employee(values):
+    # Returns (EmployeeRecord, error) for one employee from the form or the bulk
+    # API. Scores outside 1.0-5.0 count as empty, Officer/Senior premium scores
+    # are cleared, and every core competency (incl. requirement) must be present.
+    row = ["" if values.get(k) is None else str(values.get(k)).strip() for k in EMPLOYEE_TEXT_FIELDS]
+    missing = [k for k in EMPLOYEE_REQUIRED_FIELDS if not row[FIELD_INDEX[k]]]
+    if missing:
+        return None, f"Missing required fields: {', '.join(missing)}"
+
+    row += [safe_float(values.get(k)) for k in EMPLOYEE_SCORE_FIELDS]
+    restricted = row[_TITLE_AT] in CLASSIFICATION_RESTRICTED_TITLES
+    if restricted:
+        for i, j in _PREMIUM_AT:
+            row[i] = row[j] = None
+
+    if any(row[i] is None or row[j] is None for i, j in (_RESTRICTED_AT if restricted else _CORE_AT)):
+        return None, "Core competencies must not be empty and must be between 1.0 and 5.0"
+    return EmployeeRecord._make(row), None
+
+
+@app.route("/submit", methods=["POST"])
+def submit():
+    row, error = validate_employee(request.form)
+    if error:
+        flash(error, "danger")
+        keep_form_draft()
+        return redirect(url_for("index"))
+
+    conn = get_db()
+    c = conn.cursor()
+    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+    stamp_columns, stamp = insert_stamp(conn)
+    columns = EMPLOYEE_INPUT_FIELDS + ["classification_core", "classification_new", "pct_core", "pct_new",
+                                       *stamp_columns]
+
+    # Stored with the row, classification reads them back
+    pct_core, pct_new = record_pct(row)
+
+    # The unique (lower(code), year) index does the duplicate check; until
+    # migration 003 can create it, check explicitly
+    key = (row.code.lower(), row.year)
+    duplicate = 3 in deferred_migrations and key in fetch_existing_code_years(conn, table_name, [key[0]])
+    if not duplicate:
+        insert_verb = "INSERT OR IGNORE" if isinstance(conn, sqlite3.Connection) else "INSERT"
+        on_conflict = "" if isinstance(conn, sqlite3.Connection) else "ON CONFLICT DO NOTHING"
+        c.execute(f"""
+            {insert_verb} INTO {table_name} ({', '.join(columns)})
+            VALUES ({get_placeholder(conn, len(columns))})
+            {on_conflict}
+        """, (*row, "Pending", "Pending", pct_core, pct_new, *stamp))
+        duplicate = c.rowcount == 0
+    if duplicate:
+        conn.rollback()
+        flash(f"Employee code '{row.code}' already exists for year '{row.year}'.", "danger")
+        keep_form_draft()
+        return redirect(url_for("index"))
+
+    # Update classification for the new employee's cohort
+    reclassify_all(conn, table_name, {row_partition_key(row)})
+    conn.commit()
+    bump_cache_generation()
+    discard_draft(session.pop("draft_id", None))
+
+    flash("Employee submitted and classifications updated.", "success")
+    return redirect("/employees")
+
+# --- Classification kernel (NumPy) ---
+# pct_core / pct_new are stored per row: record_pct computes them when the app
+# inserts, employee_pct_sql backfills them and keeps them current when scores
+# are updated. Officer/Senior are scored on the core competencies only, every
+# other title on core + premium; pct_new uses the new competencies for everyone
+# (see the competency registry). A pct is NULL when a score or requirement it
+# uses is missing or the requirements sum to 0. Classification then only needs
+# (id, label, pct) per row.
+def _pct_at(record, pairs):
+    score_sum = req_sum = 0
+    for i, j in pairs:
+        score, req = record[i], record[j]
+        if score is None or req is None:
+            return None
+        score_sum += score
+        req_sum += req
+    if req_sum == 0:
+        return None
+    return (score_sum / req_sum) * 100
+
+
+def record_pct(record):
+    # (pct_core, pct_new) for an EmployeeRecord (or any row in EMPLOYEE_INPUT_FIELDS order)
+    core = _RESTRICTED_AT if record[_TITLE_AT] in CLASSIFICATION_RESTRICTED_TITLES else _CORE_AT
+    return _pct_at(record, core), _pct_at(record, _NEW_AT)
+
+
+def _pct_sql(keys, prefix=""):
+    return (f"({' + '.join(prefix + k for k in keys)}) / "
+            f"NULLIF({' + '.join(prefix + k + '_req' for k in keys)}, 0) * 100.0")
+
+
+def employee_pct_sql(prefix=""):
+    # SQL twin of record_pct; prefix is "NEW." inside triggers
+    restricted = ", ".join(f"'{t}'" for t in CLASSIFICATION_RESTRICTED_TITLES)
+    pct_core = (f"CASE WHEN {prefix}title IN ({restricted}) "
+                f"THEN {_pct_sql(CLASSIFICATION_RESTRICTED_KEYS, prefix)} "
+                f"ELSE {_pct_sql(CLASSIFICATION_CORE_KEYS, prefix)} END")
+    return pct_core, _pct_sql(CLASSIFICATION_NEW_KEYS, prefix)
+
+
+def partition_arrays(rows_raw):
+    # rows_raw: (id, current_label, pct) -> column arrays
+    n = len(rows_raw)
+    ids = np.fromiter((r[0] for r in rows_raw), dtype=np.int64, count=n)
+    current = np.array([r[1] for r in rows_raw], dtype=object)
+    pct = np.fromiter((r[2] for r in rows_raw), dtype=float, count=n)
+    return ids, current, pct
+
+
+def compute_thresholds(pcts):
+    sd = np.std(pcts, ddof=1)
+    return float(pcts.max() - sd), float(pcts.min() + sd)
+
+
+def classify_pct(pcts, high_thres, low_thres):
+    return np.where(pcts > high_thres, "High", np.where(pcts < low_thres, "Low", "Medium")).astype(object)
+
+# --- Classification partitions ---
+# Thresholds are computed per cohort: rows are grouped by CLASSIFICATION_PARTITION
+# (comma-separated subset of year/division/department, empty = whole table).
+# Writes only recompute the partitions they touch; independent partitions are
+# classified in a process pool once there is enough work to pay for it. When the
+# setting changes (or a database still has labels from global thresholds), the
+# first request queues one full reclassification (check_classification_partition).
+CLASSIFICATION_PARTITION_CHOICES = ("year", "division", "department")
+CLASSIFICATION_PARTITION = [c.strip().lower() for c in os.getenv("CLASSIFICATION_PARTITION", "year").split(",") if c.strip()]
+if any(c not in CLASSIFICATION_PARTITION_CHOICES for c in CLASSIFICATION_PARTITION):
+    raise ValueError(f"CLASSIFICATION_PARTITION must only use: {', '.join(CLASSIFICATION_PARTITION_CHOICES)}")
+CLASSIFICATION_WORKERS = int(os.getenv("CLASSIFICATION_WORKERS", str(min(4, os.cpu_count() or 1))))
+CLASSIFICATION_PARALLEL_MIN_ROWS = int(os.getenv("CLASSIFICATION_PARALLEL_MIN_ROWS", "50000"))
+
+_classification_pool = None
+_classification_pool_pid = None
+_classification_pool_lock = threading.Lock()
+
+
+def partition_key(values):
+    # Same normalisation as COALESCE(col, '') on the stored TEXT columns
+    return tuple("" if v is None or _is_missing(v) else str(v) for v in values)
+
+
+_PARTITION_AT = [FIELD_INDEX[c] for c in CLASSIFICATION_PARTITION]
+
+
+def row_partition_key(record):
+    return partition_key(record[i] for i in _PARTITION_AT)
+
+
+def fetch_partition_keys(conn, table_name, ids):
+    if not CLASSIFICATION_PARTITION:
+        return {()}
+    c = conn.cursor()
+    keys = set()
+    for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+        chunk = list(ids[i:i + SQLITE_MAX_PARAMS])
+        c.execute(
+            f"SELECT {', '.join(CLASSIFICATION_PARTITION)} FROM {table_name} WHERE id IN ({get_placeholder(conn, len(chunk))})",
+            chunk
+        )
+        keys.update(partition_key(row) for row in c.fetchall())
+    return keys
+
+
+def _get_classification_pool():
+    # spawn, not fork: the web process is threaded and may hold locks at fork time
+    global _classification_pool, _classification_pool_pid
+    with _classification_pool_lock:
+        if _classification_pool is None or _classification_pool_pid != os.getpid():
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            _classification_pool = ProcessPoolExecutor(
+                max_workers=CLASSIFICATION_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+            _classification_pool_pid = os.getpid()
+        return _classification_pool
+
+
+def classify_partition(args):
+    # Top-level so it can run in a worker process; returns (changed, thresholds, rows scored)
+    ids, current, pct = args
+    if len(pct) < 2:
+        # Nothing to rank a lone row against (no sample std): Medium, like a
+        # partition whose rows all score the same
+        thresholds = None
+        labels = np.full(len(pct), "Medium", dtype=object)
+    else:
+        thresholds = compute_thresholds(pct)
+        labels = classify_pct(pct, *thresholds)
+
+    # Only rows whose label actually moves are written back
+    moved = labels != current
+    changed = list(zip(labels[moved].tolist(), ids[moved].tolist(), pct[moved].tolist()))
+    return changed, thresholds, len(pct)
+
+
+def _select_partitions(conn, table_name, columns, partitions):
+    # Rows of the requested partitions (all rows if partitions is None), partition columns first
+    c = conn.cursor()
+    query = f"SELECT {', '.join(CLASSIFICATION_PARTITION + columns)} FROM {table_name}"
+    if partitions is None or not CLASSIFICATION_PARTITION:
+        c.execute(query)
+        return c.fetchall()
+
+    # Narrow on the first partition column (indexed as COALESCE(col, '')), the rest is filtered in Python
+    first = CLASSIFICATION_PARTITION[0]
+    values = sorted({p[0] for p in partitions})
+    if not isinstance(conn, sqlite3.Connection):
+        c.execute(f"{query} WHERE COALESCE({first}, '') = ANY(%s)", (values,))
+        return c.fetchall()
+    rows = []
+    for i in range(0, len(values), SQLITE_MAX_PARAMS):
+        chunk = values[i:i + SQLITE_MAX_PARAMS]
+        c.execute(f"{query} WHERE COALESCE({first}, '') IN ({get_placeholder(conn, len(chunk))})", chunk)
+        rows.extend(c.fetchall())
+    return rows
+
+
+def update_classification_for_all(conn, table_name, pct_field, field_to_update, partitions=None, report=None):
+    # Relabels field_to_update from the stored pct_field.
+    # partitions: set of partition keys to recompute (see row_partition_key), None = all
+    # report(done, total, message), if given, is called after each partition
+    if partitions is not None and not partitions:
+        return 0
+    c = conn.cursor()
+
+    # Lấy bản ghi (theo partition) cùng với nhãn hiện tại và pct đã lưu
+    n_keys = len(CLASSIFICATION_PARTITION)
+    groups = {}
+    for row in _select_partitions(conn, table_name, ["id", field_to_update, pct_field], partitions):
+        if row[-1] is None:
+            continue
+        key = partition_key(row[:n_keys])
+        if partitions is None or key in partitions:
+            groups.setdefault(key, []).append(row[n_keys:])
+
+    work = [partition_arrays(rows) for rows in groups.values()]
+    total_rows = sum(len(rows) for rows in groups.values())
+    if CLASSIFICATION_WORKERS > 1 and len(work) > 1 and total_rows >= CLASSIFICATION_PARALLEL_MIN_ROWS:
+        results = _get_classification_pool().map(classify_partition, work)
+    else:
+        results = map(classify_partition, work)
+
+    changed = []
+    for i, (key, (part_changed, thresholds, scored)) in enumerate(zip(groups, results), 1):
+        if report:
+            report(i, len(work), f"Classifying {field_to_update}: partition {i} of {len(work)}")
+        if thresholds:
+            logger.debug("%s %s: High if > %.2f, Low if < %.2f (%d of %d rows changed)",
+                         field_to_update, key, *thresholds, len(part_changed), scored)
+        changed.extend(part_changed)
+
+    # One set-based UPDATE per label instead of one statement per row
+    debug = logger.isEnabledFor(logging.DEBUG)
+    by_label = {}
+    for label, emp_id, pct in changed:
+        if debug:
+            logger.debug("ID %s → PCT: %.2f → %s", emp_id, pct, label)
+        by_label.setdefault(label, []).append(emp_id)
+
+    for label, ids in by_label.items():
+        if isinstance(conn, sqlite3.Connection):
+            for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+                chunk = ids[i:i + SQLITE_MAX_PARAMS]
+                c.execute(
+                    f"UPDATE {table_name} SET {field_to_update} = ? WHERE id IN ({get_placeholder(conn, len(chunk))})",
+                    (label, *chunk)
+                )
+        else:
+            c.execute(f"UPDATE {table_name} SET {field_to_update} = %s WHERE id = ANY(%s)", (label, ids))
+    # Caller commits, so a reclassification can share the transaction of the write that caused it
+    return len(changed)
+
+# --- Excel upload validation (column-wise) ---
+UPLOAD_REQUIRED_COLS = list(EMPLOYEE_TEXT_FIELDS)
+UPLOAD_CORE_FIELDS = list(CLASSIFICATION_RESTRICTED_KEYS)
+UPLOAD_CORE_REQ_FIELDS = [k + "_req" for k in CLASSIFICATION_RESTRICTED_KEYS]
+# Premium competencies (only for non-Officer/Senior)
+UPLOAD_PREMIUM_FIELDS = list(CLASSIFICATION_PREMIUM_KEYS)
+UPLOAD_PREMIUM_REQ_FIELDS = [k + "_req" for k in CLASSIFICATION_PREMIUM_KEYS]
+
+
+def safe_float(v):
+    try:
+        val = float(v)
+        if val < 1.0 or val > 5.0:
+            return None
+        return val
+    except:
+        return None
+
+
+def _text_column(series):
+    # str(v).strip() for present values, "" for NaN/None
+    out = pd.Series("", index=series.index, dtype=object)
+    present = series.notna()
+    out[present] = series[present].astype(str).str.strip()
+    return out
+
+
+def _is_filled(series, mask=None):
+    # Not NaN and not a blank string, optionally restricted to the rows in mask
+    filled = series.notna()
+    if mask is not None:
+        filled &= mask
+    if not pd.api.types.is_numeric_dtype(series) and filled.any():
+        filled[filled] = series[filled].astype(str).str.strip() != ""
+    return filled
+
+
+def _score_column(series):
+    # Column-wise equivalent of: None if blank/NaN else safe_float(value)
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        values = series.astype(float)
+    else:
+        values = pd.to_numeric(series, errors="coerce").astype(float)
+        # to_numeric is stricter than float() (e.g. "1_5"); fall back per cell
+        # only where it gave up on a non-blank value
+        fallback = _is_filled(series, values.isna())
+        if fallback.any():
+            values[fallback] = series[fallback].map(lambda v: safe_float(v) or np.nan)
+    in_range = values.notna() & (values >= 1.0) & (values <= 5.0)
+    return values.astype(object).where(in_range, None)
+
+
+def fetch_existing_code_years(conn, table_name, codes):
+    c = conn.cursor()
+    existing = set()
+    for i in range(0, len(codes), SQLITE_MAX_PARAMS):
+        chunk = codes[i:i + SQLITE_MAX_PARAMS]
+        c.execute(
+            f"SELECT LOWER(code), year FROM {table_name} WHERE LOWER(code) IN ({get_placeholder(conn, len(chunk))})",
+            chunk
+        )
+        existing.update((row[0], str(row[1])) for row in c.fetchall())
+    return existing
+
+
+def validate_upload_frame(df, existing_code_year, duplicate_keys=None):
+    # Returns (valid_rows as EmployeeRecords, skipped_details, error_mask) with the same reasons and
+    # row numbers the old per-row loop produced. duplicate_keys, if given, holds the
+    # (code, year) keys repeated anywhere in the file (for chunked validation).
+    index = df.index
+    base_cols = df[UPLOAD_REQUIRED_COLS].astype(object)
+
+    code = _text_column(base_cols["code"])
+    full_name = _text_column(base_cols["full_name"])
+    title = _text_column(base_cols["title"])
+    year = _text_column(base_cols["year"])
+    code_lower = code.str.lower()
+
+    checks = []  # (mask, message Series or str) in reporting order
+    checks.append((code == "", "Missing employee code"))
+    checks.append((full_name == "", "Missing full name"))
+
+    # Duplicate (code, year) inside the file
+    keys = pd.DataFrame({"code": code_lower, "year": year}, index=index)
+    if duplicate_keys is None:
+        duplicated = keys.duplicated(keep=False)
+    else:
+        duplicated = pd.Series([k in duplicate_keys for k in zip(code_lower, year)], index=index, dtype=bool)
+    checks.append((duplicated,
+                   "Duplicate code " + code + " with year " + year + " in file"))
+
+    # Duplicate (code, year) already in database
+    existing = pd.DataFrame(list(existing_code_year), columns=["code", "year"]).drop_duplicates()
+    merged = keys.merge(existing, on=["code", "year"], how="left", indicator=True)
+    in_db = pd.Series((merged["_merge"] == "both").to_numpy(), index=index)
+    checks.append((in_db, "Employee code " + code + " with year " + year + " already exists in database"))
+
+    # Only registered competency columns are read; anything else in the sheet is ignored
+    data_cols = [k for k in EMPLOYEE_SCORE_FIELDS if k in df.columns]
+    data = pd.DataFrame({k: _score_column(df[k]) for k in data_cols}, index=index, dtype=object)
+
+    # Officer/Senior must leave premium competencies empty
+    restricted = title.isin(CLASSIFICATION_RESTRICTED_TITLES)
+    for f in UPLOAD_PREMIUM_FIELDS + UPLOAD_PREMIUM_REQ_FIELDS:
+        if f in df.columns:
+            checks.append((_is_filled(df[f], restricted), title + " not allowed to fill " + f))
+
+    # Core competencies must NOT be null (premium is core for everyone but Officer/Senior);
+    # same order as before: actual scores first, then requirements
+    for key in UPLOAD_CORE_FIELDS + UPLOAD_PREMIUM_FIELDS + UPLOAD_CORE_REQ_FIELDS + UPLOAD_PREMIUM_REQ_FIELDS:
+        missing = data[key].isna() if key in data.columns else pd.Series(True, index=index)
+        if key in UPLOAD_PREMIUM_FIELDS or key in UPLOAD_PREMIUM_REQ_FIELDS:
+            missing &= ~restricted
+        checks.append((missing, f"Missing value for {key} (core competency)"))
+
+    error_mask = pd.Series(False, index=index)
+    for mask, _ in checks:
+        error_mask |= mask
+
+    skipped_details = []
+    if error_mask.any():
+        columns = []
+        for mask, message in checks:
+            mask = mask[error_mask]
+            if isinstance(message, str):
+                columns.append(np.where(mask, message, None))
+            else:
+                columns.append(message[error_mask].where(mask, None).to_numpy())
+        positions = np.flatnonzero(error_mask.to_numpy())
+        for pos, idx, messages in zip(positions, index[error_mask], zip(*columns)):
+            skipped_details.append({
+                "row": idx + 2,
+                "code": code.iat[pos],
+                "full_name": full_name.iat[pos],
+                "reason": "; ".join(m for m in messages if m is not None)
+            })
+
+    valid = ~error_mask
+    for f in UPLOAD_PREMIUM_FIELDS + UPLOAD_PREMIUM_REQ_FIELDS:
+        if f in data.columns:
+            data.loc[restricted, f] = None
+
+    base = pd.DataFrame({
+        "year": base_cols["year"],
+        "code": code,
+        "full_name": full_name,
+        "title": title,
+        "department": base_cols["department"],
+        "division": base_cols["division"],
+    }, index=index)
+    # Absent columns (e.g. premium ones an Officer-only sheet leaves out) become None
+    frame = pd.concat([base, data], axis=1)[valid].reindex(columns=EMPLOYEE_INPUT_FIELDS).astype(object)
+    frame = frame.where(frame.notna(), None)
+    records = list(map(EmployeeRecord._make, frame.itertuples(index=False, name=None)))
+
+    return records, skipped_details, error_mask
+
+# --- Upload staging store ---
+# Validated uploads wait on disk until /extra-info commits them; the session
+# only carries the upload id. Layout: <STAGING_FOLDER>/<upload_id>/meta.json,
+# rows.jsonl (one valid row per line, a list in EMPLOYEE_INPUT_FIELDS order)
+# and errors.jsonl (skipped rows as value
+# lists, columns in meta["error_columns"]). The downloadable report is only
+# built from errors.jsonl when someone asks for it (see /download-skipped).
+STAGING_FOLDER = os.path.abspath(os.path.join(UPLOAD_FOLDER, "staging"))
+UPLOAD_STAGING_TTL = int(os.getenv("UPLOAD_STAGING_TTL", str(24 * 3600)))
+UPLOAD_PREVIEW_ROWS = int(os.getenv("UPLOAD_PREVIEW_ROWS", "200"))
+os.makedirs(STAGING_FOLDER, exist_ok=True)
+
+
+def _staging_dir(upload_id):
+    if not upload_id or not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+        return None
+    return os.path.join(STAGING_FOLDER, upload_id)
+
+
+def purge_expired_uploads():
+    cutoff = time.time() - UPLOAD_STAGING_TTL
+    for folder in (STAGING_FOLDER, INCOMING_FOLDER):
+        for name in os.listdir(folder):
+            _purge_if_older(os.path.join(folder, name), cutoff)
+    purge_artifacts()
+
+
+def _purge_if_older(path, cutoff):
+    try:
+        if os.path.getmtime(path) < cutoff:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+    except OSError:
+        pass
+
+
+class StagedUpload:
+    # Writes a staged upload incrementally, so chunked uploads never hold all
+    # rows at once. finish() writes meta.json and returns the upload id.
+    def __init__(self):
+        purge_expired_uploads()
+        self.upload_id = uuid.uuid4().hex
+        self.path = _staging_dir(self.upload_id)
+        os.makedirs(self.path)
+        self._rows = open(os.path.join(self.path, "rows.jsonl"), "w", encoding="utf-8")
+        self._errors = None
+        self._error_columns = None
+
+    def add_rows(self, valid_rows):
+        self._rows.writelines(json.dumps(row, default=str) + "\n" for row in valid_rows)
+
+    def add_errors(self, df_errors):
+        if df_errors is None or not len(df_errors):
+            return
+        if self._errors is None:
+            self._errors = open(os.path.join(self.path, "errors.jsonl"), "w", encoding="utf-8")
+            self._error_columns = [str(c) for c in df_errors.columns]
+        for row in df_errors.itertuples(index=False, name=None):
+            self._errors.write(json.dumps([None if _is_missing(v) else v for v in row], default=str) + "\n")
+
+    def _close(self):
+        self._rows.close()
+        if self._errors is not None:
+            self._errors.close()
+
+    def finish(self, summary):
+        self._close()
+        summary = dict(summary)
+        summary["error_columns"] = self._error_columns
+
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, default=str)
+        return self.upload_id
+
+    def discard(self):
+        self._close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _is_missing(v):
+    try:
+        return bool(pd.isna(v))
+    except (TypeError, ValueError):
+        return False
+
+
+def stage_upload(summary, valid_rows, df_errors=None):
+    staged = StagedUpload()
+    try:
+        staged.add_rows(valid_rows)
+        staged.add_errors(df_errors)
+        return staged.finish(summary)
+    except Exception:
+        staged.discard()
+        raise
+
+
+def load_staged_upload(upload_id):
+    path = _staging_dir(upload_id)
+    if not path or not os.path.isdir(path):
+        return None
+    if os.path.getmtime(path) < time.time() - UPLOAD_STAGING_TTL:
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def iter_staged_rows(upload_id, limit=None):
+    path = _staging_dir(upload_id)
+    with open(os.path.join(path, "rows.jsonl"), encoding="utf-8") as fh:
+        for i, line in enumerate(fh):
+            if limit is not None and i >= limit:
+                break
+            values = json.loads(line)
+            if isinstance(values, dict):
+                # Staged before rows were stored as lists
+                values = [values.get(k) for k in EMPLOYEE_INPUT_FIELDS]
+            yield EmployeeRecord._make(values)
+
+
+def iter_staged_errors(upload_id, columns, chunk_size=None):
+    # Skipped rows in the export chunk protocol: column names first, then lists of rows
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    yield columns
+    with open(os.path.join(_staging_dir(upload_id), "errors.jsonl"), encoding="utf-8") as fh:
+        chunk = []
+        for line in fh:
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def discard_staged_upload(upload_id):
+    path = _staging_dir(upload_id)
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        remove_artifacts(f"skipped-{upload_id}")
+
+
+# --- Artifact store ---
+# Generated downloads (e.g. the skipped-rows workbook) are built on first
+# request and kept in ARTIFACT_FOLDER for repeat downloads. Artifacts expire
+# ARTIFACT_TTL seconds after their last use, and the least recently used ones
+# are evicted once the folder exceeds ARTIFACT_MAX_BYTES.
+ARTIFACT_FOLDER = os.path.abspath(os.path.join(UPLOAD_FOLDER, "artifacts"))
+ARTIFACT_TTL = int(os.getenv("ARTIFACT_TTL", "3600"))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(256 * 1024 * 1024)))
+os.makedirs(ARTIFACT_FOLDER, exist_ok=True)
+
+
+def purge_artifacts(keep=None):
+    cutoff = time.time() - ARTIFACT_TTL
+    entries = []
+    for name in os.listdir(ARTIFACT_FOLDER):
+        path = os.path.join(ARTIFACT_FOLDER, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if st.st_mtime < cutoff:
+            _purge_if_older(path, cutoff)
+        else:
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= ARTIFACT_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def get_artifact(name, build):
+    # Path of artifact `name`, calling build(fh) to write it if it isn't stored yet
+    path = os.path.join(ARTIFACT_FOLDER, name)
+    try:
+        os.utime(path)  # mark as recently used
+        return path
+    except FileNotFoundError:
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(dir=ARTIFACT_FOLDER, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            build(fh)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    purge_artifacts(keep=path)
+    return path
+
+
+def remove_artifacts(prefix):
+    for name in os.listdir(ARTIFACT_FOLDER):
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(ARTIFACT_FOLDER, name))
+            except OSError:
+                pass
+
+
+class UploadError(ValueError):
+    pass
+
+
+# --- Streaming upload reader ---
+# Large workbooks (and every CSV) are read in UPLOAD_CHUNK_ROWS-row chunks with
+# openpyxl's read-only mode / pandas' chunked CSV reader instead of loading the
+# whole sheet. Two passes: the first only collects (code, year) keys for the
+# duplicate and database checks, the second validates and stages each chunk.
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "5000"))
+UPLOAD_STREAM_THRESHOLD = int(os.getenv("UPLOAD_STREAM_THRESHOLD", str(10 * 1024 * 1024)))
+
+
+def _is_csv(filename):
+    return str(filename).lower().endswith(".csv")
 
-        classification_core TEXT,
-        classification_new TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    conn.commit()
-    conn.close()
 
+EXCEL_ERROR_VALUES = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"}
 
-# 4️ ROUTES
-@app.route("/")
-def index():
-    form_data = session.pop("form_data", None)
-    return render_template("form.html", form_data=form_data)
 
-# --- Employee List + Search Icon ---
-@app.route("/employees")
-def employees():
-    search = request.args.get("search", "").strip()
-    conn = get_connection()
-    c = conn.cursor()
+def _excel_value(value):
+    # Same conversions pandas' openpyxl reader applies
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in EXCEL_ERROR_VALUES:
+        return np.nan
+    return value
 
-    # PostgreSQL need schema to "public."
-    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
 
-    if search:
-        query = f"SELECT * FROM {table_name} WHERE full_name ILIKE %s OR code ILIKE %s OR division ILIKE %s OR department ILIKE %s ORDER BY id DESC" \
-            if not isinstance(conn, sqlite3.Connection) else \
-            f"SELECT * FROM {table_name} WHERE full_name LIKE ? OR code LIKE ? OR division LIKE ? OR department LIKE ? ORDER BY id DESC"
-        c.execute(query, (f"%{search}%", f"%{search}%",f"%{search}%",f"%{search}%"))
-    else:
-        c.execute(f"SELECT * FROM {table_name} ORDER BY id DESC")
+def _normalise_columns(columns):
+    return [str(c).strip().lower() for c in columns]
 
-    columns = [desc[0] for desc in c.description]
-    rows = [dict(zip(columns, row)) for row in c.fetchall()]
-    conn.close()
 
-    return render_template("employees.html", rows=rows, search=search)
+def read_upload_header(path):
+    if _is_csv(path):
+        return _normalise_columns(pd.read_csv(path, nrows=0).columns)
 
-# --- \Add member ---
-@app.route("/submit", methods=["POST"])
-def submit():
-    from statistics import stdev
-    f = request.form
-    year, code, full_name = f.get("year"), f.get("code"), f.get("full_name")
-    title, department, division = f.get("title"), f.get("department"), f.get("division")
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        first = next(wb.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        header = [_excel_value(v) for v in first]
+    finally:
+        wb.close()
+    while header and header[-1] == "":
+        header.pop()
+    return _normalise_columns(h if h != "" else f"Unnamed: {i}" for i, h in enumerate(header))
+
+
+def iter_upload_frames(path, chunk_rows=UPLOAD_CHUNK_ROWS, usecols=None):
+    # Yields object-dtype DataFrames of up to chunk_rows rows, indexed by the row's
+    # position in the sheet body (row number in the file = index + 2).
+    if _is_csv(path):
+        reader = pd.read_csv(path, chunksize=chunk_rows, dtype=object,
+                             usecols=(lambda c: str(c).strip().lower() in usecols) if usecols else None)
+        for chunk in reader:
+            chunk.columns = _normalise_columns(chunk.columns)
+            yield chunk
+        return
 
-    def safe_float(v):
-        try:
-            val = float(v)
-            if 1.0 <= val <= 5.0:
-                return val
-        except:
-            pass
-        return None
+    from openpyxl import load_workbook
+    from pandas.io.parsers import TextParser
 
-    all_fields = [
-        "communication", "continuous_learning", "critical_thinking",
-        "data_analysis", "digital_literacy", "problem_solving",
-        "strategic_thinking", "talent_management", "teamwork_leadership",
-        "communication_req", "continuous_learning_req", "critical_thinking_req",
-        "data_analysis_req", "digital_literacy_req", "problem_solving_req",
-        "strategic_thinking_req", "talent_management_req", "teamwork_leadership_req",
-        "creative_thinking", "resilience", "ai_bigdata", "analytical_thinking",
-        "creative_thinking_req", "resilience_req", "ai_bigdata_req", "analytical_thinking_req"
-    ]
-    data = {k: safe_float(f.get(k)) for k in all_fields}
-
-    if title in ["Officer", "Senior"]:
-        for k in ["strategic_thinking", "talent_management", "teamwork_leadership",
-                  "strategic_thinking_req", "talent_management_req", "teamwork_leadership_req"]:
-            data[k] = None
-
-    core_keys = ["communication", "continuous_learning", "critical_thinking",
-                 "data_analysis", "digital_literacy", "problem_solving"]
-    core_req_keys = ["communication_req", "continuous_learning_req", "critical_thinking_req",
-                     "data_analysis_req", "digital_literacy_req", "problem_solving_req"]
-
-    if title not in ["Officer", "Senior"]:
-        core_keys += ["strategic_thinking", "talent_management", "teamwork_leadership"]
-        core_req_keys += ["strategic_thinking_req", "talent_management_req", "teamwork_leadership_req"]
-
-    new_keys = ["creative_thinking", "resilience", "ai_bigdata", "analytical_thinking"]
-    new_req_keys = ["creative_thinking_req", "resilience_req", "ai_bigdata_req", "analytical_thinking_req"]
-
-    missing_core = [k for k in core_keys + core_req_keys if data.get(k) is None]
-    if missing_core:
-        flash("Core competencies must not be empty and must be between 1.0 and 5.0", "danger")
-        session["form_data"] = request.form.to_dict()
-        return redirect(url_for("index"))
+    header = read_upload_header(path)
+    keep = [i for i, c in enumerate(header) if not usecols or c in usecols]
+    columns = [header[i] for i in keep]
+    first, last = keep[0], keep[-1]
+    keep = [i - first for i in keep]
 
-    conn = get_connection()
-    c = conn.cursor()
-    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
-    placeholders = get_placeholder(conn, 34)
-
-    query_check = f"SELECT COUNT(*) FROM {table_name} WHERE LOWER(code) = %s AND year = %s" \
-        if not isinstance(conn, sqlite3.Connection) else \
-        f"SELECT COUNT(*) FROM {table_name} WHERE LOWER(code) = ? AND year = ?"
-    c.execute(query_check, (code.lower(), year))
-    if c.fetchone()[0] > 0:
-        conn.close()
-        flash(f"Employee code '{code}' already exists for year '{year}'.", "danger")
-        session["form_data"] = request.form.to_dict()
-        return redirect(url_for("index"))
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(min_row=2, min_col=first + 1, max_col=last + 1, values_only=True)
+        buffer, blanks, offset = [], [], 0
+        for raw in rows:
+            raw += (None,) * (last - first + 1 - len(raw))
+            values = [_excel_value(raw[i]) for i in keep]
+            # Blank rows only count if data follows them (pandas trims trailing ones)
+            if all(v == "" for v in values):
+                blanks.append(values)
+                continue
+            buffer.extend(blanks)
+            blanks = []
+            buffer.append(values)
+            if len(buffer) >= chunk_rows:
+                yield _frame_from_rows(columns, buffer, offset, TextParser)
+                offset += len(buffer)
+                buffer = []
+        if buffer:
+            yield _frame_from_rows(columns, buffer, offset, TextParser)
+    finally:
+        wb.close()
 
-    def calculate_pct(score_keys, req_keys):
-        scores = [data[k] for k in score_keys if data[k] is not None]
-        reqs = [data[k] for k in req_keys if data[k] is not None]
-        if not scores or not reqs:
-            return None
-        total_score = sum(scores)
-        total_req = sum(reqs)
-        if total_req == 0:
-            return None
-        return (total_score / total_req) * 100
 
-    pct_core = calculate_pct(core_keys, core_req_keys)
-    pct_new = calculate_pct(new_keys, new_req_keys)
+def _frame_from_rows(columns, rows, offset, TextParser):
+    df = TextParser([columns] + rows, header=0, dtype=object).read()
+    df.index = pd.RangeIndex(offset, offset + len(df))
+    return df
 
-    c.execute(f"""
-        INSERT INTO {table_name} (
-            year, code, full_name, title, department, division,
-            communication, continuous_learning, critical_thinking,
-            data_analysis, digital_literacy, problem_solving,
-            strategic_thinking, talent_management, teamwork_leadership,
-            communication_req, continuous_learning_req, critical_thinking_req,
-            data_analysis_req, digital_literacy_req, problem_solving_req,
-            strategic_thinking_req, talent_management_req, teamwork_leadership_req,
-            creative_thinking, resilience, ai_bigdata, analytical_thinking,
-            creative_thinking_req, resilience_req, ai_bigdata_req, analytical_thinking_req,
-            classification_core, classification_new
-        )
-        VALUES ({placeholders})
-    """, (
-        year, code, full_name, title, department, division,
-        *[data[k] for k in all_fields[:9]],
-        *[data[k] for k in all_fields[9:18]],
-        *[data[k] for k in all_fields[18:22]],
-        *[data[k] for k in all_fields[22:26]],
-        "Pending", "Pending"
-    ))
-    conn.commit()
 
-    # Update classification for all employees
-    update_classification_for_all(conn, table_name, core_keys, core_req_keys, "classification_core")
-    update_classification_for_all(conn, table_name, new_keys, new_req_keys, "classification_new")
+def process_upload_streaming(conn, path, filename, report=None):
+    try:
+        columns = read_upload_header(path)
+    except Exception:
+        raise UploadError("Invalid CSV file format." if _is_csv(path) else "Invalid Excel file format.")
+    missing_cols = [c for c in UPLOAD_REQUIRED_COLS if c not in columns]
+    if missing_cols:
+        raise UploadError(f"Missing required columns: {', '.join(missing_cols)}")
 
-    conn.close()
-    flash("Employee submitted and all classifications updated.", "success")
-    return redirect("/employees")
+    table = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
 
-def update_classification_for_all(conn, table_name, score_keys_all, req_keys_all, field_to_update):
-    import statistics
-    c = conn.cursor()
+    # Pass 1: (code, year) keys only
+    counts = Counter()
+    total = 0
+    for chunk in iter_upload_frames(path, usecols={"code", "year"}):
+        counts.update(zip(_text_column(chunk["code"]).str.lower(), _text_column(chunk["year"])))
+        total += len(chunk)
+        if report:
+            report(0, total, f"Reading file ({total} rows)")
+    duplicate_keys = {key for key, n in counts.items() if n > 1}
+    existing_code_year = fetch_existing_code_years(conn, table, sorted({code for code, _ in counts}))
+    del counts
+
+    # Pass 2: validate and stage chunk by chunk
+    staged = StagedUpload()
+    skipped_details = []
+    success = 0
+    done = 0
+    try:
+        for chunk in iter_upload_frames(path):
+            valid_rows, skipped, error_mask = validate_upload_frame(chunk, existing_code_year, duplicate_keys)
+            staged.add_rows(valid_rows)
+            staged.add_errors(chunk[error_mask])
+            skipped_details.extend(skipped)
+            success += len(valid_rows)
+            done += len(chunk)
+            if report:
+                report(done, total, f"Validated {done} of {total} rows")
+
+        return staged.finish({
+            "filename": filename,
+            "success": success,
+            "skipped_count": len(skipped_details),
+            "skipped_details": skipped_details,
+            "time": datetime.now().strftime("%d/%m/%Y %H:%M"),
+        })
+    except Exception:
+        staged.discard()
+        raise
 
-    # Lấy tất cả bản ghi cùng với title và các trường cần thiết
-    c.execute(f"SELECT id, title, {', '.join(score_keys_all + req_keys_all)} FROM {table_name}")
-    rows_raw = c.fetchall()
 
-    rows = []
-    for row in rows_raw:
-        emp_id = row[0]
-        title = row[1]
-        values = dict(zip(score_keys_all + req_keys_all, row[2:]))
-
-        if title in ["Officer", "Senior"]:
-            # Chỉ cần 6 core
-            keys = [
-                "communication", "continuous_learning", "critical_thinking",
-                "data_analysis", "digital_literacy", "problem_solving"
-            ]
-        else:
-            # Đủ 9 core
-            keys = score_keys_all
+def process_upload(conn, source, filename, report=None):
+    # Parse, validate and stage an uploaded workbook; returns the staged upload id.
+    # CSVs and workbooks over UPLOAD_STREAM_THRESHOLD bytes are read in chunks.
+    if isinstance(source, str) and (_is_csv(source) or os.path.getsize(source) > UPLOAD_STREAM_THRESHOLD):
+        return process_upload_streaming(conn, source, filename, report)
 
-        req_keys = [k + "_req" for k in keys]
+    try:
+        # object dtype like the streaming reader: a blank in an integer column
+        # would otherwise turn it float and the years into "2024.0"
+        df = pd.read_excel(source, dtype=object)
+    except Exception:
+        raise UploadError("Invalid Excel file format.")
 
-        # Lấy điểm thực và yêu cầu
-        scores = [values.get(k) for k in keys if values.get(k) is not None]
-        reqs = [values.get(k) for k in req_keys if values.get(k) is not None]
+    df.columns = [c.strip().lower() for c in df.columns]
 
-        # Nếu thiếu trường nào → bỏ qua dòng
-        if len(scores) != len(keys) or len(reqs) != len(req_keys):
-            continue
+    missing_cols = [c for c in UPLOAD_REQUIRED_COLS if c not in df.columns]
+    if missing_cols:
+        raise UploadError(f"Missing required columns: {', '.join(missing_cols)}")
+    if report:
+        report(0, len(df), "Validating rows")
 
-        total_score = sum(scores)
-        total_req = sum(reqs)
-        if total_req == 0:
-            continue
+    table = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
 
-        pct = (total_score / total_req) * 100
-        rows.append((emp_id, pct))
+    # Look up only the codes in this file, via the (lower(code), year) index
+    codes = df["code"].dropna().astype(str).str.strip().str.lower().unique().tolist()
+    existing_code_year = fetch_existing_code_years(conn, table, codes)
 
-    if len(rows) < 2:
-        return
+    valid_rows, skipped_details, error_mask = validate_upload_frame(df, existing_code_year)
+    success = len(valid_rows)
+    if report:
+        report(len(df), len(df), "Staging valid rows")
+
+    # Stage server-side (no insert); the session only keeps the upload id
+    return stage_upload({
+        "filename": filename,
+        "success": success,
+        "skipped_count": len(skipped_details),
+        "skipped_details": skipped_details,
+        "time": datetime.now().strftime("%d/%m/%Y %H:%M"),
+    }, valid_rows, df[error_mask])
 
-    pcts = [r[1] for r in rows]
-    pct_min = min(pcts)
-    pct_max = max(pcts)
-    sd = statistics.stdev(pcts)
-    high_thres = pct_max - sd
-    low_thres = pct_min + sd
-
-    for emp_id, pct in rows:
-        if pct > high_thres:
-            label = "High"
-        elif pct < low_thres:
-            label = "Low"
-        else:
-            label = "Medium"
-
-        update_q = f"UPDATE {table_name} SET {field_to_update} = %s WHERE id = %s" \
-            if not isinstance(conn, sqlite3.Connection) else \
-            f"UPDATE {table_name} SET {field_to_update} = ? WHERE id = ?"
-        print(pct_max)
-        print(pct_min)
-        print(f"High if > {high_thres:.2f}, Low if < {low_thres:.2f}")
-        print(f"ID {emp_id} → PCT: {pct:.2f} → {label}")
-        c.execute(update_q, (label, emp_id))
-    conn.commit()
 
 @app.route("/upload", methods=["POST"])
 def upload_excel():
@@ -331,194 +2391,213 @@ def upload_excel():
         flash("No file selected.", "danger")
         return redirect(url_for("employees"))
 
+    # Parsing and validation run as a background job; the browser waits on /jobs/<id>/wait
+    path = os.path.join(INCOMING_FOLDER, uuid.uuid4().hex + (".csv" if _is_csv(file.filename) else ".xlsx"))
+    file.save(path)
+    job_id = enqueue_job("upload", {"path": path, "filename": file.filename})
+    return redirect(url_for("job_wait", job_id=job_id))
+
+
+# --- Batch upload ---
+# /upload-batch takes several workbooks / CSVs (and .zip archives of them) and
+# reads every sheet that has the required columns, so one workbook per division
+# or one sheet per year both work. Files are parsed in parallel worker
+# processes; duplicate (code, year) keys are then detected across all sources
+# and everything is validated into a single staged upload, which is committed
+# and reclassified once. commit=1 (with handler / note) commits straight away
+# and answers with the job as JSON, for scripted imports.
+UPLOAD_BATCH_WORKERS = int(os.getenv("UPLOAD_BATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "200"))
+# Upper bound on what the .zip files in one batch may expand to
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+UPLOAD_EXTENSIONS = (".xlsx", ".csv")
+
+
+def parse_upload_file(path):
+    # Top-level so it can run in a worker process.
+    # Returns [(sheet name, DataFrame or None, note)], one entry per sheet (a CSV is one unnamed sheet)
     try:
-        df = pd.read_excel(file)
+        sheets = ({None: pd.read_csv(path, dtype=object)} if _is_csv(path)
+                  else pd.read_excel(path, sheet_name=None, dtype=object))
     except Exception:
-        flash("Invalid Excel file format.", "danger")
-        return redirect(url_for("employees"))
+        return [(None, None, "Invalid CSV file." if _is_csv(path) else "Invalid Excel file format.")]
+
+    results = []
+    for name, df in sheets.items():
+        df.columns = _normalise_columns(df.columns)
+        missing = [c for c in UPLOAD_REQUIRED_COLS if c not in df.columns]
+        if missing:
+            results.append((name, None, f"Missing required columns: {', '.join(missing)}"))
+        elif df.empty:
+            results.append((name, None, "No rows"))
+        else:
+            results.append((name, df, None))
+    return results
 
-    df.columns = [c.strip().lower() for c in df.columns]
 
-    required_cols = ["year", "code", "full_name", "title", "department", "division"]
-    missing_cols = [c for c in required_cols if c not in df.columns]
-    if missing_cols:
-        flash(f"Missing required columns: {', '.join(missing_cols)}", "danger")
-        return redirect(url_for("employees"))
+def expand_batch_files(files):
+    # [(display name, path)] of the workbooks / CSVs in files, unpacking .zip archives next to them
+    import zipfile
 
-    def safe_float(v):
+    sources = []
+    unpacked = 0
+    for name, path in files:
+        if not name.lower().endswith(".zip"):
+            sources.append((name, path))
+            continue
         try:
-            val = float(v)
-            if val < 1.0 or val > 5.0:
-                return None
-            return val
-        except:
-            return None
-
-    conn = get_connection()
-    c = conn.cursor()
+            archive = zipfile.ZipFile(path)
+        except zipfile.BadZipFile:
+            raise UploadError(f"{name} is not a valid zip file.")
+        with archive:
+            for member in archive.infolist():
+                base = os.path.basename(member.filename)
+                if (member.is_dir() or base.startswith(".") or member.filename.startswith("__MACOSX/")
+                        or not base.lower().endswith(UPLOAD_EXTENSIONS)):
+                    continue
+                unpacked += member.file_size
+                if unpacked > UPLOAD_BATCH_MAX_BYTES:
+                    raise UploadError(f"Zip files expand to more than {UPLOAD_BATCH_MAX_BYTES // (1024 * 1024)} MB.")
+                # Never trust member paths; only the extension is kept
+                target = os.path.join(os.path.dirname(path), uuid.uuid4().hex + os.path.splitext(base)[1].lower())
+                with archive.open(member) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                sources.append((f"{name}/{member.filename}", target))
+
+    if not sources:
+        raise UploadError("No .xlsx or .csv files found in the upload.")
+    if len(sources) > UPLOAD_BATCH_MAX_FILES:
+        raise UploadError(f"Too many files in one batch ({len(sources)}, limit {UPLOAD_BATCH_MAX_FILES}).")
+    return sources
+
+
+def process_upload_batch(conn, sources, report=None):
+    # Parse all sources (in parallel), validate them as one upload and stage it; returns the upload id
+    paths = [path for _, path in sources]
+    if report:
+        report(0, len(paths), f"Reading {len(paths)} files")
+    if UPLOAD_BATCH_WORKERS > 1 and len(paths) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # A pool per batch: batches are rare, and idle workers would hold pandas in memory
+        with ProcessPoolExecutor(max_workers=min(UPLOAD_BATCH_WORKERS, len(paths)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            parsed = []
+            for i, result in enumerate(pool.map(parse_upload_file, paths), 1):
+                parsed.append(result)
+                if report:
+                    report(i, len(paths), f"Read {i} of {len(paths)} files")
+    else:
+        parsed = [parse_upload_file(path) for path in paths]
+
+    frames, sources_summary = [], []
+    for (name, _), sheets in zip(sources, parsed):
+        for sheet, df, note in sheets:
+            label = name if sheet is None or len(sheets) == 1 else f"{name} [{sheet}]"
+            entry = {"name": label, "rows": 0 if df is None else len(df), "valid": 0, "skipped": 0, "note": note}
+            sources_summary.append(entry)
+            if df is not None:
+                frames.append((entry, df))
+    if not frames:
+        raise UploadError("None of the files has a sheet with the required columns: "
+                          + ", ".join(UPLOAD_REQUIRED_COLS))
+
+    # Duplicates and existing rows are checked across the whole batch
+    counts = Counter()
+    for _, df in frames:
+        counts.update(zip(_text_column(df["code"]).str.lower(), _text_column(df["year"])))
+    duplicate_keys = {key for key, n in counts.items() if n > 1}
     table = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+    existing_code_year = fetch_existing_code_years(conn, table, sorted({code for code, _ in counts if code}))
 
-    # Select Employee Code and Year list have storaged in DB
-    c.execute(f"SELECT LOWER(code), year FROM {table}")
-    existing_code_year = set((row[0], str(row[1])) for row in c.fetchall())
-
-    # Create a temporary column to check duplicates in Excel file (code + year combination)
-    df["_code_year"] = df.apply(
-        lambda r: (str(r["code"]).strip().lower() if pd.notna(r["code"]) else "", 
-                  str(r["year"]).strip() if pd.notna(r["year"]) else ""), 
-        axis=1
-    )
-    # Count occurrences of each (code, year) combination
-    code_year_counts = df["_code_year"].value_counts()
-
-    success = 0
+    # One error report for all sources: a source column, then every column seen
+    error_columns = list(dict.fromkeys(c for _, df in frames for c in df.columns))
+    staged = StagedUpload()
     skipped_details = []
-    valid_rows = []
-    rows_with_errors = []
-
-    for idx, row in df.iterrows():
-        errors = []
-
-        code = str(row.get("code")).strip() if pd.notna(row.get("code")) else ""
-        full_name = str(row.get("full_name")).strip() if pd.notna(row.get("full_name")) else ""
-        title = str(row.get("title")).strip() if pd.notna(row.get("title")) else ""
-
-        if not code:
-            errors.append("Missing employee code")
-        if not full_name:
-            errors.append("Missing full name")
-
-        year = str(row.get("year")).strip() if pd.notna(row.get("year")) else ""
-        
-        # Check code duplicated in Excel file (same code and year)
-        current_code_year = (code.lower(), year)
-        if code_year_counts.get(current_code_year, 0) > 1:
-            errors.append(f"Duplicate code {code} with year {year} in file")
-
-        # Check code duplicated in Database (same code and year)
-        if (code.lower(), year) in existing_code_year:
-            errors.append(f"Employee code {code} with year {year} already exists in database")
-
-        # Process competency fields - handle NaN/empty values properly
-        data = {}
-        for k in df.columns:
-            if k not in required_cols and not str(k).startswith("_"):
-                val = row.get(k)
-                # Check if value is NaN or empty string
-                if pd.isna(val) or (isinstance(val, str) and val.strip() == ""):
-                    data[k] = None
-                else:
-                    data[k] = safe_float(val)
-
-        # Core vs New competency lists
-        core_fields = [
-            "communication", "continuous_learning", "critical_thinking",
-            "data_analysis", "digital_literacy", "problem_solving"
-        ]
-        core_req_fields = [
-            "communication_req", "continuous_learning_req", "critical_thinking_req",
-            "data_analysis_req", "digital_literacy_req", "problem_solving_req"
-        ]
-        
-        # Premium competencies (only for non-Officer/Senior)
-        premium_fields = ["strategic_thinking", "talent_management", "teamwork_leadership"]
-        premium_req_fields = ["strategic_thinking_req", "talent_management_req", "teamwork_leadership_req"]
-        
-        # Validate forbid inputing competency premium for Officer/Senior
-        if title in ["Officer", "Senior"]:
-            for f in premium_fields + premium_req_fields:
-                val = row.get(f)
-                if pd.notna(val) and str(val).strip() != "":
-                    errors.append(f"{title} not allowed to fill {f}")
-                # Set to None for Officer/Senior
-                data[f] = None
-        else:
-            # For non-Officer/Senior, premium fields are part of core
-            core_fields += premium_fields
-            core_req_fields += premium_req_fields
-
-        new_fields = ["creative_thinking", "resilience", "ai_bigdata", "analytical_thinking"]
-        new_req_fields = ["creative_thinking_req", "resilience_req", "ai_bigdata_req", "analytical_thinking_req"]
-
-        # 1) Core competencies must NOT be null (except premium for Officer/Senior which are already set to None)
-        # Ensure all core fields are in data dict (even if column doesn't exist in Excel)
-        for key in core_fields + core_req_fields:
-            if key not in data:
-                # Column doesn't exist in Excel, treat as missing
-                data[key] = None
-            val = data.get(key)
-            if val is None:
-                errors.append(f"Missing value for {key} (core competency)")
-
-        # 2) Range check 1.0–5.0 for all non-null numeric fields (core & new)
-        for key, val in data.items():
-            if val is not None and (val < 1.0 or val > 5.0):
-                errors.append(f"Invalid value {val} for {key}")
-
-        # Error --> Skip record
-        if errors:
-            skipped_details.append({
-                "row": idx + 2,
-                "code": code,
-                "full_name": full_name,
-                "reason": "; ".join(errors)
-            })
-            rows_with_errors.append(row)
-            continue
-
-        # Valid -> append to valid_rows list
-        valid_rows.append({
-            "year": row.get("year"),
-            "code": code,
-            "full_name": full_name,
-            "title": title,
-            "department": row.get("department"),
-            "division": row.get("division"),
-            **data
+    success = 0
+    try:
+        for i, (entry, df) in enumerate(frames, 1):
+            label = entry["name"]
+            valid_rows, skipped, error_mask = validate_upload_frame(df, existing_code_year, duplicate_keys)
+            staged.add_rows(valid_rows)
+            errors = df[error_mask].reindex(columns=error_columns)
+            errors.insert(0, "source", label)
+            staged.add_errors(errors)
+            for item in skipped:
+                item["source"] = label
+            skipped_details.extend(skipped)
+            success += len(valid_rows)
+            entry["valid"], entry["skipped"] = len(valid_rows), len(skipped)
+            if report:
+                report(i, len(frames), f"Validated {i} of {len(frames)} sheets")
+
+        names = ", ".join(name for name, _ in sources)
+        return staged.finish({
+            "filename": names if len(names) <= 500 else names[:497] + "...",
+            "success": success,
+            "skipped_count": len(skipped_details),
+            "skipped_details": skipped_details,
+            "sources": sources_summary,
+            "time": datetime.now().strftime("%d/%m/%Y %H:%M"),
         })
-        success += 1
+    except Exception:
+        staged.discard()
+        raise
 
-    # Clean up temporary column
-    df.drop("_code_year", axis=1, inplace=True, errors="ignore")
-    conn.close()
 
-    if rows_with_errors:
-        df_errors = pd.DataFrame(rows_with_errors)
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-        df_errors.to_excel(tmp.name, index=False)
-        error_file_path = tmp.name
-    else:
-        error_file_path = None
+@app.route("/upload-batch", methods=["POST"])
+def upload_batch():
+    commit = request.form.get("commit") == "1"
 
-    # Saved session (no insert)
-    session["upload_summary"] = {
-        "filename": file.filename,
-        "success": success,
-        "skipped_count": len(skipped_details),
-        "skipped_details": skipped_details,
-        "valid_rows": valid_rows,
-        "time": datetime.now().strftime("%d/%m/%Y %H:%M"),
-        "error_file": error_file_path
-    }
+    def reject(message):
+        if commit:
+            return jsonify({"error": message}), 400
+        flash(message, "danger")
+        return redirect(url_for("index"))
 
-    return redirect(url_for("additional_info"))
+    files = [f for f in request.files.getlist("files") if f and f.filename]
+    if not files:
+        return reject("No files selected.")
+    unsupported = [f.filename for f in files if not f.filename.lower().endswith(UPLOAD_EXTENSIONS + (".zip",))]
+    if unsupported:
+        return reject(f"Unsupported file type: {', '.join(unsupported)} (use .xlsx, .csv or .zip).")
+
+    folder = os.path.join(INCOMING_FOLDER, uuid.uuid4().hex)
+    os.makedirs(folder)
+    saved = []
+    for f in files:
+        path = os.path.join(folder, uuid.uuid4().hex + os.path.splitext(f.filename)[1].lower())
+        f.save(path)
+        saved.append((f.filename, path))
+
+    job_id = enqueue_job("upload_batch", {
+        "folder": folder,
+        "files": saved,
+        "commit": commit,
+        "handler": request.form.get("handler"),
+        "note": request.form.get("note"),
+    })
+    if commit:
+        return jsonify({"job_id": job_id, "status_url": url_for("job_status", job_id=job_id)}), 202
+    return redirect(url_for("job_wait", job_id=job_id))
 
 # --- View detail employee ---
 @app.route("/detail/<int:emp_id>")
 def detail(emp_id):
-    conn = get_connection()
-    c = conn.cursor()
-    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
-    query = f"SELECT * FROM {table_name} WHERE id = %s" if not isinstance(conn, sqlite3.Connection) else f"SELECT * FROM {table_name} WHERE id = ?"
-    c.execute(query, (emp_id,))
-    row = c.fetchone()
-    columns = [desc[0] for desc in c.description]
-    conn.close()
-
-    if not row:
+    def load():
+        conn = get_db()
+        c = conn.cursor()
+        table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+        query = f"SELECT * FROM {table_name} WHERE id = %s" if not isinstance(conn, sqlite3.Connection) else f"SELECT * FROM {table_name} WHERE id = ?"
+        c.execute(query, (emp_id,))
+        row = c.fetchone()
+        columns = [desc[0] for desc in c.description]
+        return dict(zip(columns, row)) if row else None
+
+    employee = cached(cache_key(f"detail/{emp_id}"), load)
+    if not employee:
         return "Employee not found", 404
 
-    employee = dict(zip(columns, row))
     return render_template("detail.html", employee=employee)
 
 
@@ -531,30 +2610,21 @@ def delete_selected():
         return redirect(url_for("employees"))
 
     ids = tuple(int(i) for i in ids)
-    conn = get_connection()
+    conn = get_db()
     c = conn.cursor()
     table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
     placeholders = ",".join(["?"] * len(ids)) if isinstance(conn, sqlite3.Connection) else ",".join(["%s"] * len(ids))
 
     try:
-        # 1. Xóa bản ghi
+        # 1. Xóa bản ghi (nhớ lại các partition bị ảnh hưởng)
+        partitions = fetch_partition_keys(conn, table_name, ids)
         query = f"DELETE FROM {table_name} WHERE id IN ({placeholders})"
         c.execute(query, ids)
         conn.commit()
 
-        # 2. Cập nhật lại phân loại cho toàn bộ dữ liệu còn lại
-        core_keys = ["communication", "continuous_learning", "critical_thinking",
-                     "data_analysis", "digital_literacy", "problem_solving",
-                     "strategic_thinking", "talent_management", "teamwork_leadership"]
-        core_req_keys = ["communication_req", "continuous_learning_req", "critical_thinking_req",
-                         "data_analysis_req", "digital_literacy_req", "problem_solving_req",
-                         "strategic_thinking_req", "talent_management_req", "teamwork_leadership_req"]
-
-        new_keys = ["creative_thinking", "resilience", "ai_bigdata", "analytical_thinking"]
-        new_req_keys = ["creative_thinking_req", "resilience_req", "ai_bigdata_req", "analytical_thinking_req"]
-
-        update_classification_for_all(conn, table_name, core_keys, core_req_keys, "classification_core")
-        update_classification_for_all(conn, table_name, new_keys, new_req_keys, "classification_new")
+        # 2. Cập nhật lại phân loại cho các partition đó
+        reclassify_all(conn, table_name, partitions)
+        conn.commit()
 
         flash(f"Deleted {len(ids)} record(s) and updated classification successfully!", "success")
 
@@ -563,24 +2633,137 @@ def delete_selected():
         flash(f"Error deleting: {e}", "danger")
     finally:
         c.close()
-        conn.close()
+        # The delete itself may have committed even if reclassification failed
+        bump_cache_generation()
 
     return redirect(url_for("employees"))
 
 
-# --- Export Excel ---
+# --- Export Excel / CSV / Parquet ---
+# Rows are read in chunks (server-side named cursor on Postgres) and written
+# straight into the response, so memory stays flat whatever the table size.
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "employee_data.xlsx"),
+    "csv": ("text/csv", "employee_data.csv"),
+    "parquet": ("application/vnd.apache.parquet", "employee_data.parquet"),
+}
+EXPORT_TEXT_COLUMNS = {
+    "year", "code", "full_name", "title", "department", "division",
+    "classification_core", "classification_new", "created_at", "updated_at"
+}
+
+
+def stream_query(conn, query, params=(), chunk_size=EXPORT_CHUNK_SIZE):
+    # Yields the column names first, then lists of up to chunk_size rows
+    if isinstance(conn, sqlite3.Connection):
+        c = conn.cursor()
+    else:
+        c = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        c.itersize = chunk_size
+    try:
+        c.execute(query, params)
+        chunk = c.fetchmany(chunk_size)
+        yield [desc[0] for desc in c.description]
+        while chunk:
+            yield chunk
+            chunk = c.fetchmany(chunk_size)
+    finally:
+        c.close()
+
+
+def _iter_file(fh, block_size=64 * 1024):
+    try:
+        fh.seek(0)
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        fh.close()
+
+
+def export_csv(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(next(chunks))
+    yield buf.getvalue().encode("utf-8-sig")
+    for chunk in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(chunk)
+        yield buf.getvalue().encode("utf-8")
+
+
+def write_xlsx(chunks, fh):
+    from openpyxl import Workbook
+
+    # write_only keeps just the current row in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(next(chunks))
+    for chunk in chunks:
+        for row in chunk:
+            ws.append(row)
+    wb.save(fh)
+
+
+def export_xlsx(chunks):
+    # The finished zip goes to an anonymous temp file that is removed as soon as it's closed
+    fh = tempfile.TemporaryFile()
+    write_xlsx(chunks, fh)
+    return _iter_file(fh)
+
+
+def export_parquet(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = next(chunks)
+    schema = pa.schema([
+        (k, pa.string() if k in EXPORT_TEXT_COLUMNS else pa.int64() if k == "id" else pa.float64())
+        for k in columns
+    ])
+    fh = tempfile.TemporaryFile()
+    with pq.ParquetWriter(fh, schema) as writer:
+        for chunk in chunks:
+            data = {}
+            for i, k in enumerate(columns):
+                values = [row[i] for row in chunk]
+                if k in EXPORT_TEXT_COLUMNS:
+                    values = [None if v is None else str(v) for v in values]
+                data[k] = values
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+    return _iter_file(fh)
+
+
 @app.route("/export")
 def export_data():
-    conn = get_connection()
+    fmt = request.args.get("format", "xlsx").lower()
+    if fmt not in EXPORT_FORMATS:
+        flash(f"Unsupported export format '{fmt}'.", "danger")
+        return redirect(url_for("employees"))
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            flash("Parquet export requires the pyarrow package.", "danger")
+            return redirect(url_for("employees"))
+
+    conn = get_db()
     table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
-    df = pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY id DESC", conn)
-    conn.close()
+    chunks = stream_query(conn, f"SELECT * FROM {table_name} ORDER BY id DESC")
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-    df.to_excel(tmp.name, index=False)
-    tmp.seek(0)
+    writer = {"xlsx": export_xlsx, "csv": export_csv, "parquet": export_parquet}[fmt]
+    mimetype, filename = EXPORT_FORMATS[fmt]
 
-    return send_file(tmp.name, as_attachment=True, download_name="employee_data.xlsx")
+    @stream_with_context
+    def generate():
+        yield from writer(chunks)
+
+    return Response(generate(), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 # --- Download Excel Template ---
 @app.route("/download-template")
@@ -590,136 +2773,901 @@ def download_template():
 
 
 # --- API endpoint ---
+# ?format=ndjson|csv streams every matching row (ordered by id) instead of one
+# page; since_seq limits it to rows added or changed since the last pull (pass
+# the highest change_seq seen so far). since_id only catches new rows, and
+# updated_after is approximate: timestamps are taken at write time, so a slow
+# commit can land behind a watermark. Each row carries change_seq and
+# updated_at (last modified, or created_at).
+API_STREAM_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def parse_sync_args(args):
+    since_id = args.get("since_id")
+    since_seq = args.get("since_seq")
+    updated_after = args.get("updated_after")
+    try:
+        since_id = int(since_id) if since_id else None
+    except ValueError:
+        raise PaginationError("since_id must be an integer")
+    try:
+        since_seq = int(since_seq) if since_seq else None
+    except ValueError:
+        raise PaginationError("since_seq must be an integer")
+    if updated_after:
+        try:
+            updated_after = datetime.fromisoformat(updated_after.replace("Z", "+00:00"))
+        except ValueError:
+            raise PaginationError("updated_after must be an ISO 8601 timestamp")
+        if updated_after.tzinfo is not None:
+            updated_after = updated_after.astimezone(timezone.utc).replace(tzinfo=None)
+    return since_id, since_seq, updated_after or None
+
+
+def stream_employees(conn, source, params, columns, fmt, since_id=None, since_seq=None, updated_after=None,
+                     filters=()):
+    ph = "?" if isinstance(conn, sqlite3.Connection) else "%s"
+    columns = [k for k in columns if k not in ("change_seq", "updated_at")]
+    conditions, filter_params = range_conditions(conn, filters)
+    params = list(params) + filter_params
+    if since_id is not None:
+        conditions.append(f"id > {ph}")
+        params.append(since_id)
+    if since_seq is not None:
+        conditions.append(f"change_seq > {ph}")
+        params.append(since_seq)
+    if updated_after is not None:
+        conditions.append(f"COALESCE(updated_at, created_at) > {ph}")
+        # SQLite stores timestamps as text: compare in the same format
+        params.append(updated_after.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+                      if isinstance(conn, sqlite3.Connection) else updated_after)
+
+    query = f"SELECT {', '.join(columns)}, change_seq, COALESCE(updated_at, created_at) AS updated_at FROM {source}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+    chunks = stream_query(conn, query, params)
+
+    if fmt == "csv":
+        return export_csv(chunks)
+
+    def ndjson():
+        names = next(chunks)
+        for chunk in chunks:
+            yield "".join(json.dumps(dict(zip(names, row)), default=str) + "\n" for row in chunk).encode("utf-8")
+    return ndjson()
+
+
 @app.route("/api/employees")
 def api_employees():
-    conn = get_connection()
+    search = request.args.get("search", "").strip()
+    fmt = request.args.get("format", "json").lower()
+    if fmt != "json" and fmt not in API_STREAM_FORMATS:
+        return jsonify({"error": f"Unsupported format '{fmt}'"}), 400
+    try:
+        page = parse_page_args(request.args, searching=bool(search))
+        since_id, since_seq, updated_after = parse_sync_args(request.args)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fmt in API_STREAM_FORMATS:
+        conn = get_db()
+        table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+        source, params = table_name, ()
+        if search:
+            source, params = build_search_source(conn, table_name, search)
+        body = stream_employees(conn, source, params, page["columns"], fmt, since_id, since_seq, updated_after,
+                                page["filters"])
+        return Response(stream_with_context(body), mimetype=API_STREAM_FORMATS[fmt])
+
+    key = cache_key("api/employees", request.args)
+
+    def load():
+        conn = get_db()
+        table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+        source, params = table_name, ()
+        if search:
+            source, params = build_search_source(conn, table_name, search)
+        data, next_cursor = fetch_employee_page(
+            conn, source, page["limit"], page["sort"], page["order"], page["columns"], page["cursor"], params,
+            page["filters"]
+        )
+        return {
+            "data": data,
+            "next_cursor": next_cursor,
+            "limit": page["limit"],
+            "sort": page["sort"],
+            "order": page["order"],
+        }
+
+    # The ETag is a hash of the body, so it holds across workers and restarts;
+    # a matching If-None-Match gets a 304 (the page itself usually comes from the cache)
+    resp = jsonify(cached(key, load))
+    resp.add_etag()
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+# --- Bulk write API ---
+# POST /api/employees/bulk {"operations": [...], "atomic": true}
+# Each operation is {"op": "create" | "update" | "upsert" | "delete", "employee": {...}}
+# and names its employee by (code, year). update / upsert merge the given fields
+# into the stored employee; the result is validated like /submit. Operations are
+# applied in order to an in-memory view, then written as a handful of batched
+# statements in one transaction, followed by a single reclassification of the
+# partitions they touched. atomic (default) rejects the whole batch with 422 if
+# any item fails; atomic=false writes the valid items and reports the rest.
+BULK_API_MAX_ITEMS = int(os.getenv("BULK_API_MAX_ITEMS", "5000"))
+BULK_API_OPS = ("create", "update", "upsert", "delete")
+
+
+def _employee_key(values):
+    return str(values.get("code") or "").strip().lower(), str(values.get("year") or "").strip()
+
+
+def fetch_employees_by_key(conn, table_name, keys):
+    # {(lower(code), year): (id, EmployeeRecord)} for the keys that exist
+    c = conn.cursor()
+    columns = ["id"] + EMPLOYEE_INPUT_FIELDS
+    codes = sorted({code for code, _ in keys})
+    found = {}
+    for i in range(0, len(codes), SQLITE_MAX_PARAMS):
+        chunk = codes[i:i + SQLITE_MAX_PARAMS]
+        c.execute(
+            f"SELECT {', '.join(columns)} FROM {table_name} WHERE LOWER(code) IN ({get_placeholder(conn, len(chunk))})",
+            chunk
+        )
+        for values in c.fetchall():
+            row = EmployeeRecord._make(values[1:])
+            key = (str(row.code).lower(), str(row.year))
+            if key in keys:
+                found[key] = (values[0], row)
+    return found
+
+
+def apply_employee_operations(conn, table_name, operations, atomic=True):
+    results = []
+    keys = set()
+    for i, item in enumerate(operations):
+        op = item.get("op") if isinstance(item, dict) else None
+        employee = item.get("employee") if isinstance(item, dict) else None
+        result = {"index": i, "op": op}
+        if op not in BULK_API_OPS:
+            result["error"] = f"op must be one of: {', '.join(BULK_API_OPS)}"
+        elif not isinstance(employee, dict):
+            result["error"] = "employee must be an object"
+        else:
+            key = _employee_key(employee)
+            unknown = sorted(set(employee) - set(EMPLOYEE_INPUT_FIELDS))
+            result.update(code=employee.get("code"), year=employee.get("year"), key=key)
+            if not all(key):
+                result["error"] = "code and year are required"
+            elif unknown:
+                result["error"] = f"Unknown fields: {', '.join(unknown)}"
+            else:
+                keys.add(key)
+        results.append(result)
+
+    # Replay the operations over the stored rows: current[key] is the row as it
+    # should end up (None = absent), recreated marks stored rows deleted on the way
+    stored = fetch_employees_by_key(conn, table_name, keys)
+    current = {key: row for key, (_, row) in stored.items()}
+    recreated = set()
+    for item, result in zip(operations, results):
+        if "error" in result:
+            continue
+        key, op = result["key"], result["op"]
+        existing = current.get(key)
+        if op == "delete":
+            if existing is None:
+                result["error"] = "Employee not found"
+                continue
+            current[key] = None
+            result["status"] = "deleted"
+            continue
+        if op == "create" and existing is not None:
+            result["error"] = "Employee already exists"
+            continue
+        if op == "update" and existing is None:
+            result["error"] = "Employee not found"
+            continue
+
+        # code / year only identify an existing employee; the stored spelling is kept
+        changes = {k: v for k, v in item["employee"].items() if existing is None or k not in ("code", "year")}
+        row, error = validate_employee({**(existing._asdict() if existing else {}), **changes})
+        if error:
+            result["error"] = error
+            continue
+        if existing is None and key in stored:
+            recreated.add(key)
+        current[key] = row
+        result["status"] = "created" if existing is None else "updated"
+
+    errors = sum("error" in r for r in results)
+    committed = not (atomic and errors)
+    for r in results:
+        r.pop("key", None)
+        if "error" in r:
+            r["status"] = "error"
+        elif not committed:
+            r["status"] = "skipped"
+    outcome = {
+        "committed": committed,
+        "created": sum(r["status"] == "created" for r in results),
+        "updated": sum(r["status"] == "updated" for r in results),
+        "deleted": sum(r["status"] == "deleted" for r in results),
+        "errors": errors,
+        "results": results,
+    }
+    if not committed:
+        return outcome
+
+    # Net effect per employee
+    delete_ids, updates, inserts, partitions = [], [], [], set()
+    for key, row in current.items():
+        old_id, old = stored.get(key, (None, None))
+        if old is not None and (row is None or key in recreated):
+            delete_ids.append(old_id)
+            partitions.add(row_partition_key(old))
+        if row is None:
+            continue
+        if old is None or key in recreated:
+            inserts.append(row)
+        elif row != old:
+            updates.append((old_id, row))
+            partitions.add(row_partition_key(old))
+        else:
+            continue
+        partitions.add(row_partition_key(row))
+
     c = conn.cursor()
+    try:
+        if isinstance(conn, sqlite3.Connection):
+            for i in range(0, len(delete_ids), SQLITE_MAX_PARAMS):
+                chunk = delete_ids[i:i + SQLITE_MAX_PARAMS]
+                c.execute(f"DELETE FROM {table_name} WHERE id IN ({get_placeholder(conn, len(chunk))})", chunk)
+        elif delete_ids:
+            c.execute(f"DELETE FROM {table_name} WHERE id = ANY(%s)", (delete_ids,))
+
+        if updates:
+            columns = EMPLOYEE_INPUT_FIELDS + ["pct_core", "pct_new"]
+            ph = "?" if isinstance(conn, sqlite3.Connection) else "%s"
+            sql = f"UPDATE {table_name} SET {', '.join(f'{k} = {ph}' for k in columns)} WHERE id = {ph}"
+            params = [(*row, *record_pct(row), emp_id) for emp_id, row in updates]
+            if isinstance(conn, sqlite3.Connection):
+                c.executemany(sql, params)
+            else:
+                psycopg2.extras.execute_batch(c, sql, params, page_size=BULK_INSERT_BATCH)
+
+        stamp_columns, stamp = insert_stamp(conn)
+        bulk_insert(conn, table_name, EMPLOYEE_INPUT_FIELDS + [
+            "classification_core", "classification_new", "pct_core", "pct_new", *stamp_columns
+        ], ((*row, "Pending", "Pending", *record_pct(row), *stamp) for row in inserts))
+
+        outcome["reclassified"] = reclassify_all(conn, table_name, partitions) if partitions else 0
+
+        # Ids of everything still present (new rows got theirs from the insert)
+        final = fetch_employees_by_key(conn, table_name, {(row.code.lower(), row.year) for row in inserts}) if inserts else {}
+        for item, r in zip(operations, results):
+            if r["status"] in ("created", "updated", "deleted"):
+                key = _employee_key(item["employee"])
+                found = stored.get(key) if r["status"] == "deleted" else final.get(key) or stored.get(key)
+                r["id"] = found[0] if found else None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    bump_cache_generation()
+    return outcome
+
+
+@app.route("/api/employees/bulk", methods=["POST"])
+def api_employees_bulk():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("operations"), list):
+        return jsonify({"error": 'Expected a JSON object with an "operations" list'}), 400
+    if len(payload["operations"]) > BULK_API_MAX_ITEMS:
+        return jsonify({"error": f"At most {BULK_API_MAX_ITEMS} operations per request"}), 413
+
+    conn = get_db()
     table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
-    c.execute(f"SELECT * FROM {table_name} ORDER BY id DESC")
-    columns = [desc[0] for desc in c.description]
-    data = [dict(zip(columns, row)) for row in c.fetchall()]
-    conn.close()
-    return jsonify(data)
+    try:
+        outcome = apply_employee_operations(conn, table_name, payload["operations"],
+                                            atomic=payload.get("atomic", True) is not False)
+    except (sqlite3.IntegrityError, psycopg2.IntegrityError) as e:
+        # Someone else wrote one of these employees since we read them
+        return jsonify({"error": f"Conflicting concurrent write, nothing was saved: {e}"}), 409
+    return jsonify(outcome), 200 if outcome["committed"] else 422
+
+
+# --- Aggregates API ---
+# Label counts and average pct from employee_summary, e.g.
+#   /api/aggregates?group_by=division
+#   /api/aggregates?group_by=year,department&year=2025
+# group_by and the filters take year / division / department; an empty
+# group_by returns one overall group.
+@app.route("/api/aggregates")
+def api_aggregates():
+    group_by = [g.strip() for g in request.args.get("group_by", "division").split(",") if g.strip()]
+    unknown = [g for g in group_by if g not in SUMMARY_GROUP_COLUMNS]
+    if unknown:
+        return jsonify({"error": f"Cannot group by: {', '.join(unknown)}"}), 400
+    filters = {k: request.args[k] for k in SUMMARY_GROUP_COLUMNS if k in request.args}
+
+    def load():
+        conn = get_db()
+        c = conn.cursor()
+        summary_table = "public.employee_summary" if not isinstance(conn, sqlite3.Connection) else "employee_summary"
+        ph = "?" if isinstance(conn, sqlite3.Connection) else "%s"
+        keys = group_by + ["classification_core", "classification_new"]
+        query = f"""
+            SELECT {', '.join(keys)}, SUM(employees), SUM(pct_core_sum), SUM(pct_core_count),
+                   SUM(pct_new_sum), SUM(pct_new_count)
+            FROM {summary_table}
+        """
+        if filters:
+            query += " WHERE " + " AND ".join(f"{k} = {ph}" for k in filters)
+        query += f" GROUP BY {', '.join(keys)}"
+        c.execute(query, list(filters.values()))
+
+        groups = {}
+        n = len(group_by)
+        for row in c.fetchall():
+            label_core, label_new = row[n] or "Unclassified", row[n + 1] or "Unclassified"
+            employees, core_sum, core_count, new_sum, new_count = row[n + 2:]
+            group = groups.setdefault(row[:n], {
+                **dict(zip(group_by, row[:n])),
+                "employees": 0,
+                "classification_core": {},
+                "classification_new": {},
+                "_pct": [0.0, 0, 0.0, 0],
+            })
+            group["employees"] += employees
+            group["classification_core"][label_core] = group["classification_core"].get(label_core, 0) + employees
+            group["classification_new"][label_new] = group["classification_new"].get(label_new, 0) + employees
+            group["_pct"][0] += core_sum or 0
+            group["_pct"][1] += core_count
+            group["_pct"][2] += new_sum or 0
+            group["_pct"][3] += new_count
+
+        data = []
+        for key in sorted(groups):
+            group = groups[key]
+            core_sum, core_count, new_sum, new_count = group.pop("_pct")
+            group["avg_pct_core"] = round(core_sum / core_count, 2) if core_count else None
+            group["avg_pct_new"] = round(new_sum / new_count, 2) if new_count else None
+            data.append(group)
+        return {"group_by": group_by, "filters": filters, "data": data}
+
+    return jsonify(cached(cache_key("api/aggregates", request.args), load))
 
 @app.route("/additional-info")
 def additional_info():
-    summary = session.get("upload_summary")
+    upload_id = session.get("upload_id")
+    summary = load_staged_upload(upload_id)
     if not summary:
         flash("Please upload a file before accessing this page.", "warning")
         return redirect(url_for("index"))
 
-    preview = summary.get("valid_rows", [])
-    summary["preview"] = preview
+    summary["preview"] = [row._asdict() for row in iter_staged_rows(upload_id, limit=UPLOAD_PREVIEW_ROWS)]
     return render_template("extra_info.html", summary=summary)
 
 @app.route("/download-skipped")
 def download_skipped():
-    summary = session.get("upload_summary")
-    if not summary or not summary.get("error_file"):
+    # Built from the staged errors.jsonl on demand: CSV is streamed, the
+    # workbook is generated once and served from the artifact store
+    upload_id = session.get("upload_id")
+    summary = load_staged_upload(upload_id)
+    if not summary or not summary.get("error_columns"):
         flash("No skipped records to download.", "warning")
         return redirect(url_for("additional_info"))
 
-    return send_file(summary["error_file"], as_attachment=True)
+    columns = summary["error_columns"]
+    if request.args.get("format", "xlsx").lower() == "csv":
+        return Response(export_csv(iter_staged_errors(upload_id, columns)), mimetype="text/csv",
+                        headers={"Content-Disposition": "attachment; filename=skipped_records.csv"})
 
-@app.route("/extra-info", methods=["POST"])
-def extra_info():
-    summary = session.get("upload_summary")
-    if not summary:
-        flash("Session expired, please upload again.", "warning")
-        return redirect(url_for("index"))
+    path = get_artifact(f"skipped-{upload_id}.xlsx", lambda fh: write_xlsx(iter_staged_errors(upload_id, columns), fh))
+    return send_file(path, as_attachment=True, download_name="skipped_records.xlsx")
+
+# --- Employee summary (aggregates) ---
+# employee_summary holds one row per (year, division, department,
+# classification_core, classification_new) with head counts and pct sums, so
+# /api/aggregates reads O(groups) rows. reclassify_all refreshes the years it
+# touched in the same transaction as the write.
+SUMMARY_GROUP_COLUMNS = ["year", "division", "department"]
+SUMMARY_LOCK_KEY = 804_202
+
+
+def refresh_employee_summary(conn, table_name, years=None):
+    # Rebuilds the summary rows of the given years (all years if None).
+    # Concurrent rebuilds of the same year would both insert its groups, so on
+    # Postgres they take turns on a transaction-level advisory lock (SQLite
+    # writers are already serialised by the database lock).
+    c = conn.cursor()
+    summary_table = "public.employee_summary" if not isinstance(conn, sqlite3.Connection) else "employee_summary"
+    if not isinstance(conn, sqlite3.Connection):
+        c.execute("SELECT pg_advisory_xact_lock(%s)", (SUMMARY_LOCK_KEY,))
+    select = f"""
+        SELECT COALESCE(year, ''), COALESCE(division, ''), COALESCE(department, ''),
+               COALESCE(classification_core, ''), COALESCE(classification_new, ''),
+               COUNT(*), SUM(pct_core), COUNT(pct_core), SUM(pct_new), COUNT(pct_new)
+        FROM {table_name} {{where}}
+        GROUP BY 1, 2, 3, 4, 5
+    """
+    insert = f"""
+        INSERT INTO {summary_table} (
+            year, division, department, classification_core, classification_new,
+            employees, pct_core_sum, pct_core_count, pct_new_sum, pct_new_count
+        )
+    """
+    if years is None:
+        c.execute(f"DELETE FROM {summary_table}")
+        c.execute(insert + select.format(where=""))
+        return
+
+    years = sorted(years)
+    for i in range(0, len(years), SQLITE_MAX_PARAMS):
+        chunk = years[i:i + SQLITE_MAX_PARAMS]
+        ph = get_placeholder(conn, len(chunk))
+        c.execute(f"DELETE FROM {summary_table} WHERE year IN ({ph})", chunk)
+        c.execute(insert + select.format(where=f"WHERE COALESCE(year, '') IN ({ph})"), chunk)
 
-    handler = request.form.get("handler")
-    note = request.form.get("note")
 
-    valid_rows = summary.get("valid_rows", [])
-    conn = get_connection()
+def partition_years(partitions):
+    # Years covered by a set of partition keys; None means every year
+    if partitions is None or "year" not in CLASSIFICATION_PARTITION:
+        return None
+    i = CLASSIFICATION_PARTITION.index("year")
+    return {p[i] for p in partitions}
+
+
+def reclassify_all(conn, table_name, partitions=None, report=None):
+    changed = update_classification_for_all(conn, table_name, "pct_core", "classification_core", partitions, report)
+    changed += update_classification_for_all(conn, table_name, "pct_new", "classification_new", partitions, report)
+    refresh_employee_summary(conn, table_name, partition_years(partitions))
+    return changed
+
+
+def commit_staged_upload(conn, upload_id, summary, handler, note, report=None):
+    # Insert, log and reclassification commit together or not at all
     c = conn.cursor()
     table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
-    placeholders = get_placeholder(conn, 34)
-
-    all_fields = [
-        "communication", "continuous_learning", "critical_thinking", "data_analysis",
-        "digital_literacy", "problem_solving", "strategic_thinking", "talent_management",
-        "teamwork_leadership", "communication_req", "continuous_learning_req",
-        "critical_thinking_req", "data_analysis_req", "digital_literacy_req",
-        "problem_solving_req", "strategic_thinking_req", "talent_management_req",
-        "teamwork_leadership_req", "creative_thinking", "resilience", "ai_bigdata",
-        "analytical_thinking", "creative_thinking_req", "resilience_req", "ai_bigdata_req",
-        "analytical_thinking_req"
-    ]
-
-    # === 1. Insert dữ liệu (classification để tạm Pending) ===
-    for row in valid_rows:
+
+    total = summary["success"]
+    partitions = set()
+    stamp_columns, stamp = insert_stamp(conn)
+
+    def staged_values():
+        for i, row in enumerate(iter_staged_rows(upload_id), 1):
+            if report and i % BULK_INSERT_BATCH == 0:
+                report(i, total, "Inserting rows")
+            partitions.add(row_partition_key(row))
+            yield (*row, "Pending", "Pending", *record_pct(row), *stamp)
+
+    try:
+        # === 1. Insert dữ liệu (classification để tạm Pending) ===
+        inserted = bulk_insert(conn, table_name, [
+            *EMPLOYEE_INPUT_FIELDS, "classification_core", "classification_new", "pct_core", "pct_new",
+            *stamp_columns
+        ], staged_values())
+
+        # === 2. Log upload ===
+        log_placeholders = get_placeholder(conn, 5)
         c.execute(f"""
-            INSERT INTO {table_name} (
-                year, code, full_name, title, department, division,
-                {", ".join(all_fields)},
-                classification_core, classification_new
-            ) VALUES ({placeholders})
+            INSERT INTO upload_log (filename, handler, note, uploaded_records, skipped_records)
+            VALUES ({log_placeholders})
         """, (
-            row["year"], row["code"], row["full_name"], row["title"],
-            row["department"], row["division"],
-            *[row.get(k) for k in all_fields],
-            "Pending", "Pending"
+            summary["filename"], handler, note,
+            summary["success"], summary["skipped_count"]
         ))
 
-    # === 2. Log upload ===
-    if isinstance(conn, sqlite3.Connection):
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS upload_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT, handler TEXT, note TEXT,
-                uploaded_records INTEGER, skipped_records INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-    else:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS upload_log (
-                id SERIAL PRIMARY KEY,
-                filename TEXT, handler TEXT, note TEXT,
-                uploaded_records INTEGER, skipped_records INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+        # === 3. Re-classify các partition có dữ liệu mới ===
+        if report:
+            report(total, total, "Updating classifications")
+        reclassify_all(conn, table_name, partitions)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    bump_cache_generation()
+    return inserted
+
+
+@app.route("/extra-info", methods=["POST"])
+def extra_info():
+    upload_id = session.get("upload_id")
+    if not load_staged_upload(upload_id):
+        flash("Session expired, please upload again.", "warning")
+        return redirect(url_for("index"))
+
+    job_id = enqueue_job("commit", {
+        "upload_id": upload_id,
+        "handler": request.form.get("handler"),
+        "note": request.form.get("note"),
+    })
+    return redirect(url_for("job_wait", job_id=job_id))
+
+
+# --- Background jobs ---
+# A small SQLite-backed queue (JOBS_DB_PATH, separate from the employee DB) for
+# upload parsing, upload commits and reclassification. JOB_RUNNER selects who
+# runs the jobs:
+#   thread   - a thread pool inside each web worker (default)
+#   external - a separate `flask --app app worker` process
+#   inline   - synchronously inside the request (tests / debugging)
+JOBS_DB_PATH = os.path.abspath(os.getenv("JOBS_DB_PATH", "jobs.db"))
+JOB_RUNNER = os.getenv("JOB_RUNNER", "thread")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# run_job touches a running job every JOB_HEARTBEAT_SECONDS (besides progress
+# reports); one not touched for JOB_STALE_SECONDS lost its worker and is re-queued
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+INCOMING_FOLDER = os.path.abspath(os.path.join(UPLOAD_FOLDER, "incoming"))
+os.makedirs(INCOMING_FOLDER, exist_ok=True)
+
+_jobs_schema_ready = False
+_job_executor = None
+_job_executor_pid = None
+_job_executor_lock = threading.Lock()
+
+
+def _jobs_connection():
+    global _jobs_schema_ready
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    if not _jobs_schema_ready:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT,
+            progress INTEGER DEFAULT 0,
+            total INTEGER,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
         """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+        conn.commit()
+        _jobs_schema_ready = True
+    return conn
+
+
+def enqueue_job(kind, payload):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with closing(_jobs_connection()) as jconn:
+        jconn.execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), now, now)
+        )
+        jconn.execute("DELETE FROM jobs WHERE updated_at < ? AND status IN ('done', 'failed')",
+                      (now - JOB_RETENTION_SECONDS,))
+        jconn.commit()
+
+    if JOB_RUNNER == "inline":
+        drain_jobs()
+    elif JOB_RUNNER == "thread":
+        _get_job_executor().submit(drain_jobs)
+    return job_id
+
+
+def get_job(job_id):
+    with closing(_jobs_connection()) as jconn:
+        row = jconn.execute(
+            "SELECT id, kind, status, progress, total, message, result, error, created_at, updated_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if not row:
+        return None
+    job = dict(zip(["id", "kind", "status", "progress", "total", "message", "result", "error",
+                    "created_at", "updated_at"], row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def claim_next_job():
+    now = time.time()
+    with closing(_jobs_connection()) as jconn:
+        jconn.execute("BEGIN IMMEDIATE")
+        row = jconn.execute(
+            "SELECT id, kind, payload FROM jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND updated_at < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (now - JOB_STALE_SECONDS,)
+        ).fetchone()
+        if row:
+            jconn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (now, row[0]))
+        jconn.commit()
+    if not row:
+        return None
+    return {"id": row[0], "kind": row[1], "payload": json.loads(row[2])}
+
+
+def _update_job(job_id, **fields):
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    with closing(_jobs_connection()) as jconn:
+        jconn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        jconn.commit()
 
-    log_placeholders = get_placeholder(conn, 5)
-    c.execute(f"""
-        INSERT INTO upload_log (filename, handler, note, uploaded_records, skipped_records)
-        VALUES ({log_placeholders})
-    """, (
-        summary["filename"], handler, note,
-        summary["success"], summary["skipped_count"]
-    ))
 
-    # === 3. Re-classify toàn bộ dữ liệu trong DB ===
-    core_keys = ["communication", "continuous_learning", "critical_thinking",
-                 "data_analysis", "digital_literacy", "problem_solving",
-                 "strategic_thinking", "talent_management", "teamwork_leadership"]
+def _job_upload(conn, payload, report):
+    try:
+        upload_id = process_upload(conn, payload["path"], payload["filename"], report)
+    finally:
+        try:
+            os.remove(payload["path"])
+        except OSError:
+            pass
+    summary = load_staged_upload(upload_id)
+    return {"upload_id": upload_id, "success": summary["success"], "skipped_count": summary["skipped_count"]}
 
-    core_req_keys = ["communication_req", "continuous_learning_req", "critical_thinking_req",
-                     "data_analysis_req", "digital_literacy_req", "problem_solving_req",
-                     "strategic_thinking_req", "talent_management_req", "teamwork_leadership_req"]
 
-    new_keys = ["creative_thinking", "resilience", "ai_bigdata", "analytical_thinking"]
-    new_req_keys = ["creative_thinking_req", "resilience_req", "ai_bigdata_req", "analytical_thinking_req"]
+def _job_upload_batch(conn, payload, report):
+    try:
+        upload_id = process_upload_batch(conn, expand_batch_files(payload["files"]), report)
+    finally:
+        shutil.rmtree(payload["folder"], ignore_errors=True)
+    summary = load_staged_upload(upload_id)
+    result = {"upload_id": upload_id, "success": summary["success"], "skipped_count": summary["skipped_count"],
+              "sources": summary["sources"]}
+    if payload.get("commit"):
+        result["inserted"] = commit_staged_upload(conn, upload_id, summary,
+                                                  payload["handler"], payload["note"], report)
+        result["skipped"] = summary["skipped_details"]
+        discard_staged_upload(upload_id)
+        del result["upload_id"]
+    return result
+
+
+def _job_commit(conn, payload, report):
+    summary = load_staged_upload(payload["upload_id"])
+    if not summary:
+        raise UploadError("Staged upload has expired, please upload again.")
+    inserted = commit_staged_upload(conn, payload["upload_id"], summary,
+                                    payload["handler"], payload["note"], report)
+    discard_staged_upload(payload["upload_id"])
+    return {"inserted": inserted}
 
-    update_classification_for_all(conn, table_name, core_keys, core_req_keys, "classification_core")
-    update_classification_for_all(conn, table_name, new_keys, new_req_keys, "classification_new")
 
+def _job_reclassify(conn, payload, report):
+    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+    changed = reclassify_all(conn, table_name, report=report)
     conn.commit()
-    conn.close()
+    bump_cache_generation()
+    return {"changed": changed}
+
+
+JOB_HANDLERS = {
+    "upload": _job_upload,
+    "upload_batch": _job_upload_batch,
+    "commit": _job_commit,
+    "reclassify": _job_reclassify,
+}
+
+
+def run_job(job):
+    def report(progress, total=None, message=None):
+        _update_job(job["id"], progress=progress, total=total, message=message)
+
+    # Heartbeat: long silent steps (a bulk insert, one big partition) must not
+    # look abandoned and get claimed by a second worker
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            _update_job(job["id"])
+
+    threading.Thread(target=heartbeat, name=f"job-heartbeat-{job['id'][:8]}", daemon=True).start()
+    scope, token = begin_metrics_scope(f"job:{job['kind']}")
+    status = "failed"
+    try:
+        conn = checkout_connection()
+    except Exception:
+        stop.set()
+        raise
+    try:
+        ensure_schema(conn)
+        result = JOB_HANDLERS[job["kind"]](conn, job["payload"], report)
+        _update_job(job["id"], status="done", result=json.dumps(result, default=str), message="Done")
+        status = "done"
+    except Exception as e:
+        if not isinstance(e, UploadError):
+            logger.exception("Job %s (%s) failed", job["id"], job["kind"])
+        _update_job(job["id"], status="failed", error=str(e))
+    finally:
+        stop.set()
+        release_connection(conn)
+        end_metrics_scope(scope, token)
+        if METRICS_ENABLED:
+            METRICS.inc("app_jobs_total", {"kind": job["kind"], "status": status})
+            METRICS.observe("app_job_duration_seconds", {"kind": job["kind"]}, time.perf_counter() - scope.started)
+
+
+def drain_jobs():
+    # Run queued jobs until the queue is empty (also picks up jobs left behind
+    # by a worker that died)
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return
+        run_job(job)
+
+
+def _get_job_executor():
+    global _job_executor, _job_executor_pid
+    with _job_executor_lock:
+        if _job_executor is None or _job_executor_pid != os.getpid():
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+            _job_executor_pid = os.getpid()
+    return _job_executor
+
+
+@app.cli.command("worker")
+def worker_command():
+    # Standalone job worker for JOB_RUNNER=external
+    logger.info("Job worker started (%d threads, queue %s)", JOB_WORKERS, JOBS_DB_PATH)
+
+    def loop():
+        while True:
+            job = claim_next_job()
+            if job is None:
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+            run_job(job)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(JOB_WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/wait")
+def job_wait(job_id):
+    job = get_job(job_id)
+    if not job:
+        flash("Job not found.", "warning")
+        return redirect(url_for("index"))
+    if job["status"] in ("done", "failed"):
+        return redirect(url_for("job_done", job_id=job_id))
+    return render_template("job.html", job=job)
+
+
+@app.route("/jobs/<job_id>/done")
+def job_done(job_id):
+    job = get_job(job_id)
+    if not job:
+        flash("Job not found.", "warning")
+        return redirect(url_for("index"))
+    if job["status"] not in ("done", "failed"):
+        return redirect(url_for("job_wait", job_id=job_id))
+
+    if job["kind"] in ("upload", "upload_batch"):
+        if job["status"] == "failed":
+            flash(job["error"], "danger")
+            return redirect(url_for("employees"))
+        if "inserted" in job["result"]:
+            flash(f"{job['result']['inserted']} records saved and classifications updated.", "success")
+            return redirect(url_for("employees"))
+        session["upload_id"] = job["result"]["upload_id"]
+        return redirect(url_for("additional_info"))
+
+    if job["kind"] == "commit":
+        if job["status"] == "failed":
+            flash(f"Error saving upload: {job['error']}", "danger")
+            return redirect(url_for("additional_info"))
+        session.pop("upload_id", None)
+        flash("Upload saved and classifications updated successfully!", "success")
+        return redirect(url_for("employees"))
 
-    flash("Upload saved and classifications updated successfully!", "success")
-    session.pop("upload_summary", None)
+    if job["status"] == "failed":
+        flash(f"Job failed: {job['error']}", "danger")
+    else:
+        flash("Classifications updated successfully!", "success")
     return redirect(url_for("employees"))
 
+
+@app.route("/reclassify", methods=["POST"])
+def reclassify():
+    job_id = enqueue_job("reclassify", {})
+    return jsonify({"job_id": job_id, "status_url": url_for("job_status", job_id=job_id)}), 202
+
+
+# --- Form drafts ---
+# The form keeps its draft in localStorage (debounced, client-side), so typing
+# costs no requests. The server only holds a draft when a submit is rejected
+# (to refill the form) or, with FORM_DRAFT_SYNC=1, when the page pushes its
+# debounced draft to /save-form. Drafts are small JSON files keyed by a short
+# id; the session cookie carries just that id.
+DRAFT_FOLDER = os.path.abspath(os.path.join(UPLOAD_FOLDER, "drafts"))
+FORM_DRAFT_TTL = int(os.getenv("FORM_DRAFT_TTL", str(7 * 24 * 3600)))
+FORM_DRAFT_MAX_BYTES = int(os.getenv("FORM_DRAFT_MAX_BYTES", str(16 * 1024)))
+FORM_DRAFT_SYNC = os.getenv("FORM_DRAFT_SYNC", "0") == "1"
+os.makedirs(DRAFT_FOLDER, exist_ok=True)
+
+
+def _draft_path(draft_id):
+    if not draft_id or not re.fullmatch(r"[0-9a-f]{16}", draft_id):
+        return None
+    return os.path.join(DRAFT_FOLDER, draft_id + ".json")
+
+
+def save_draft(values, draft_id=None):
+    # Stores the form values (under draft_id if it's valid) and returns the draft id
+    data = json.dumps(values)
+    if len(data) > FORM_DRAFT_MAX_BYTES:
+        raise ValueError("Draft is too large")
+    if not _draft_path(draft_id):
+        draft_id = uuid.uuid4().hex[:16]
+    cutoff = time.time() - FORM_DRAFT_TTL
+    for name in os.listdir(DRAFT_FOLDER):
+        _purge_if_older(os.path.join(DRAFT_FOLDER, name), cutoff)
+
+    path = _draft_path(draft_id)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:6]}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+    return draft_id
+
+
+def load_draft(draft_id):
+    path = _draft_path(draft_id)
+    if not path:
+        return None
+    try:
+        if os.path.getmtime(path) < time.time() - FORM_DRAFT_TTL:
+            return None
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def discard_draft(draft_id):
+    path = _draft_path(draft_id)
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def keep_form_draft():
+    # Lets the form come back filled in after a rejected submit
+    try:
+        session["draft_id"] = save_draft(request.form.to_dict(), session.get("draft_id"))
+    except ValueError:
+        pass
+
+
 @app.route("/save-form", methods=["POST"])
 def save_form():
-    session["form_data"] = request.form.to_dict()
+    try:
+        session["draft_id"] = save_draft(request.form.to_dict(), session.get("draft_id"))
+    except ValueError as e:
+        return (str(e), 413)
     return ("", 204)
 
 # MAIN ENTRY
 if __name__ == "__main__":
-    # init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,106 @@
+# Benchmark: classification write-back, per-row UPDATE loop vs set-based UPDATE
+# over the stored pct_core column.
+#
+#   python benchmarks/bench_classification.py --sizes 1000 10000 100000
+#
+# Runs against a throwaway SQLite file (or DATABASE_URL if it points at Postgres).
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as emp_app  # noqa: E402
+from bench_classification_kernel import legacy_pct_rows  # noqa: E402
+
+CORE_KEYS = ["communication", "continuous_learning", "critical_thinking",
+             "data_analysis", "digital_literacy", "problem_solving",
+             "strategic_thinking", "talent_management", "teamwork_leadership"]
+CORE_REQ_KEYS = [k + "_req" for k in CORE_KEYS]
+TITLES = ["Officer", "Senior", "Supervisor", "Manager", "Director"]
+
+
+def seed(conn, table_name, n, rng):
+    cols = CORE_KEYS + CORE_REQ_KEYS
+    rows = []
+    for i in range(n):
+        title = rng.choice(TITLES)
+        values = [round(rng.uniform(1, 5), 1) for _ in cols]
+        if title in ["Officer", "Senior"]:
+            for k in ["strategic_thinking", "talent_management", "teamwork_leadership"]:
+                values[cols.index(k)] = None
+                values[cols.index(k + "_req")] = None
+        record = emp_app.EmployeeRecord(**{**dict.fromkeys(emp_app.EMPLOYEE_INPUT_FIELDS), **dict(zip(cols, values)),
+                                           "title": title})
+        pct_core, _ = emp_app.record_pct(record)
+        rows.append(("2025", f"E{i:07d}", f"Employee {i}", title, "Pending", "Pending", pct_core, *values))
+    placeholders = emp_app.get_placeholder(conn, 7 + len(cols))
+    conn.cursor().executemany(
+        f"INSERT INTO {table_name} (year, code, full_name, title, classification_core, classification_new, "
+        f"pct_core, {', '.join(cols)}) VALUES ({placeholders})",
+        rows
+    )
+    conn.commit()
+
+
+def legacy_update(conn, table_name, score_keys, req_keys, field):
+    # The pre-existing write-back: one UPDATE round-trip per row
+    c = conn.cursor()
+    c.execute(f"SELECT id, title, {field}, {', '.join(score_keys + req_keys)} FROM {table_name}")
+    rows = legacy_pct_rows(c.fetchall(), score_keys, req_keys)
+    high_thres, low_thres = emp_app.compute_thresholds(np.array([r[1] for r in rows]))
+    q = f"UPDATE {table_name} SET {field} = ? WHERE id = ?" if isinstance(conn, sqlite3.Connection) \
+        else f"UPDATE {table_name} SET {field} = %s WHERE id = %s"
+    for emp_id, pct, _ in rows:
+        label = "High" if pct > high_thres else "Low" if pct < low_thres else "Medium"
+        c.execute(q, (label, emp_id))
+    conn.commit()
+
+
+def reset(conn, table_name):
+    conn.cursor().execute(f"UPDATE {table_name} SET classification_core = 'Pending'")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    if not os.getenv("DATABASE_URL", "").startswith("postgresql://"):
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmpdir.name, "bench.db")
+
+    print(f"{'rows':>8} {'per-row (s)':>12} {'set-based (s)':>14} {'speedup':>8}")
+    for n in args.sizes:
+        conn = emp_app.get_connection()
+        table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+        emp_app.init_db()
+        conn.cursor().execute(f"DELETE FROM {table_name}")
+        conn.commit()
+        seed(conn, table_name, n, random.Random(args.seed))
+
+        start = time.perf_counter()
+        legacy_update(conn, table_name, CORE_KEYS, CORE_REQ_KEYS, "classification_core")
+        legacy = time.perf_counter() - start
+
+        reset(conn, table_name)
+        start = time.perf_counter()
+        emp_app.update_classification_for_all(conn, table_name, "pct_core", "classification_core")
+        bulk = time.perf_counter() - start
+
+        print(f"{n:>8} {legacy:>12.3f} {bulk:>14.3f} {legacy / bulk:>7.1f}x")
+        conn.close()
+
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Benchmark: classification, per-row Python loop over the raw score columns vs
+# stored pct (record_pct at write time) + NumPy kernel.
+#
+#   python benchmarks/bench_classification_kernel.py --sizes 10000 100000 1000000
+#
+# No database involved: both implementations score the same synthetic rows and
+# their labels are compared before timings are reported. The old loop could not
+# score Officer/Senior rows on the "new" competencies, so that set is compared
+# on the other titles only.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as emp_app  # noqa: E402
+
+CORE_KEYS = ["communication", "continuous_learning", "critical_thinking",
+             "data_analysis", "digital_literacy", "problem_solving",
+             "strategic_thinking", "talent_management", "teamwork_leadership"]
+CORE_REQ_KEYS = [k + "_req" for k in CORE_KEYS]
+NEW_KEYS = ["creative_thinking", "resilience", "ai_bigdata", "analytical_thinking"]
+NEW_REQ_KEYS = [k + "_req" for k in NEW_KEYS]
+TITLES = ["Officer", "Senior", "Supervisor", "Manager", "Director"]
+
+
+def make_rows(n, keys, req_keys, rng):
+    rows = []
+    for i in range(n):
+        title = rng.choice(TITLES)
+        values = [round(rng.uniform(1, 5), 1) if rng.random() > 0.01 else None
+                  for _ in keys + req_keys]
+        if title in ["Officer", "Senior"]:
+            for k in ["strategic_thinking", "talent_management", "teamwork_leadership"]:
+                if k in keys:
+                    values[keys.index(k)] = None
+                    values[len(keys) + keys.index(k)] = None
+        rows.append((i + 1, title, rng.choice(["Pending", "High", "Medium", "Low"]), *values))
+    return rows
+
+
+# The original per-row compute from update_classification_for_all, kept for comparison
+def legacy_pct_rows(rows_raw, score_keys_all, req_keys_all):
+    rows = []
+    for row in rows_raw:
+        values = dict(zip(score_keys_all + req_keys_all, row[3:]))
+        if row[1] in ["Officer", "Senior"]:
+            keys = CORE_KEYS[:6]
+        else:
+            keys = score_keys_all
+        req_keys = [k + "_req" for k in keys]
+        scores = [values.get(k) for k in keys if values.get(k) is not None]
+        reqs = [values.get(k) for k in req_keys if values.get(k) is not None]
+        if len(scores) != len(keys) or len(reqs) != len(req_keys):
+            continue
+        total_req = sum(reqs)
+        if total_req == 0:
+            continue
+        rows.append((row[0], (sum(scores) / total_req) * 100, row[2]))
+    return rows
+
+
+def legacy_classify(rows_raw, score_keys_all, req_keys_all):
+    rows = legacy_pct_rows(rows_raw, score_keys_all, req_keys_all)
+    pcts = [r[1] for r in rows]
+    sd = statistics.stdev(pcts)
+    high_thres, low_thres = max(pcts) - sd, min(pcts) + sd
+    changed = []
+    for emp_id, pct, current in rows:
+        label = "High" if pct > high_thres else "Low" if pct < low_thres else "Medium"
+        if label != current:
+            changed.append((label, emp_id, pct))
+    return changed
+
+
+def store_pct(rows_raw, score_keys_all, req_keys_all):
+    # What the insert path does: one pct per row, kept with the row
+    field = 0 if score_keys_all == CORE_KEYS else 1
+    positions = [emp_app.FIELD_INDEX[k] for k in score_keys_all + req_keys_all]
+    title_at = emp_app.FIELD_INDEX["title"]
+    stored = []
+    for row in rows_raw:
+        values = [None] * len(emp_app.EMPLOYEE_INPUT_FIELDS)
+        values[title_at] = row[1]
+        for i, v in zip(positions, row[3:]):
+            values[i] = v
+        pct = emp_app.record_pct(emp_app.EmployeeRecord._make(values))[field]
+        if pct is not None:
+            stored.append((row[0], row[2], pct))
+    return stored
+
+
+def kernel_classify(stored):
+    changed, _, _ = emp_app.classify_partition(emp_app.partition_arrays(stored))
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'set':>5} {'loop (s)':>9} {'store (s)':>10} {'classify (s)':>13} {'speedup':>8}")
+    for n in args.sizes:
+        for name, keys, req_keys in (("core", CORE_KEYS, CORE_REQ_KEYS), ("new", NEW_KEYS, NEW_REQ_KEYS)):
+            rows = make_rows(n, keys, req_keys, random.Random(args.seed))
+            if name == "new":
+                rows = [r for r in rows if r[1] not in ["Officer", "Senior"]]
+
+            start = time.perf_counter()
+            expected = legacy_classify(rows, keys, req_keys)
+            loop_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            stored = store_pct(rows, keys, req_keys)
+            store_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            got = kernel_classify(stored)
+            classify_time = time.perf_counter() - start
+
+            assert [(label, emp_id) for label, emp_id, _ in got] == \
+                   [(label, emp_id) for label, emp_id, _ in expected], f"label mismatch at {n} rows ({name})"
+            assert all(a[2] == b[2] for a, b in zip(got, expected)), f"pct mismatch at {n} rows ({name})"
+            print(f"{n:>8} {name:>5} {loop_time:>9.3f} {store_time:>10.3f} {classify_time:>13.3f} "
+                  f"{loop_time / classify_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
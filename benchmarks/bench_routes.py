@@ -0,0 +1,264 @@
+# Benchmark: the hot routes end to end through the Flask test client.
+#
+#   python benchmarks/bench_routes.py --sizes 1000 10000 100000
+#   python benchmarks/bench_routes.py --sizes 10000 --routes employees,export_csv \
+#       --compare benchmarks/results/1a2b3c4-sqlite.json
+#
+# Each size gets a fresh database seeded with that many employees: SQLite in a
+# temp dir, plus Postgres when BENCH_POSTGRES_URL points at a scratch database
+# (its employee tables are emptied first). Per route it reports latency
+# percentiles, requests/s and the peak Python heap of one traced request, and
+# writes everything to benchmarks/results/<commit>-<backend>.json.
+#
+# Jobs run inline and the response cache is off unless --cache is given, so the
+# numbers are the database work of each request.
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROUTES = ["employees", "employees_search", "api_employees", "api_stream", "export_csv",
+          "submit", "upload", "extra_info"]
+
+
+def git_commit():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                    capture_output=True, text=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def measure(fn, repeat, setup=None, warmup=1):
+    # Times fn() repeat times (setup() runs untimed before each call), then traces one more call
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms = np.array(times) * 1000
+    return {
+        "requests": repeat,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "rps": round(repeat / sum(times), 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def check(resp, *ok):
+    if resp.status_code not in (ok or (200,)):
+        raise RuntimeError(f"{resp.request.path} returned {resp.status_code}")
+    return resp
+
+
+class RouteBench:
+    def __init__(self, emp_app, datagen, client, workdir, args):
+        self.app = emp_app
+        self.datagen = datagen
+        self.client = client
+        self.workdir = workdir
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.counter = 0
+
+    def _next_prefix(self, kind):
+        self.counter += 1
+        return f"{kind}{self.counter:05d}-"
+
+    def employees(self):
+        check(self.client.get("/employees"))
+
+    def employees_search(self):
+        check(self.client.get(f"/employees?search=Employee {self.rng.randrange(1000)}"))
+
+    def api_employees(self):
+        check(self.client.get("/api/employees?limit=500"))
+
+    def api_stream(self):
+        resp = check(self.client.get("/api/employees?format=ndjson"))
+        resp.get_data()
+
+    def export_csv(self):
+        resp = check(self.client.get("/export?format=csv"))
+        resp.get_data()
+
+    def submit(self):
+        row = self.datagen.make_employee(0, self.rng, self._next_prefix("S"))
+        form = {k: "" if v is None else str(v) for k, v in row.items()}
+        check(self.client.post("/submit", data=form), 302)
+
+    def _workbook(self):
+        rows = self.datagen.make_employees(self.args.upload_rows, self.rng, self._next_prefix("U"))
+        path = os.path.join(self.workdir, "upload.xlsx")
+        self.datagen.write_workbook(path, rows)
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    def prepare_upload(self):
+        self._upload_bytes = self._workbook()
+
+    def upload(self):
+        data = {"file": (io.BytesIO(self._upload_bytes), "employees.xlsx")}
+        check(self.client.post("/upload", data=data, content_type="multipart/form-data"), 302)
+
+    def prepare_extra_info(self):
+        # Stage an upload (untimed); following the redirects puts its id in the session
+        self.prepare_upload()
+        data = {"file": (io.BytesIO(self._upload_bytes), "employees.xlsx")}
+        check(self.client.post("/upload", data=data, content_type="multipart/form-data",
+                               follow_redirects=True))
+
+    def extra_info(self):
+        check(self.client.post("/extra-info", data={"handler": "bench", "note": ""}), 302)
+
+    def run(self, route):
+        repeat = self.args.repeat
+        if route in ("export_csv", "api_stream", "upload", "extra_info"):
+            repeat = self.args.heavy_repeat
+        setup = {"upload": self.prepare_upload, "extra_info": self.prepare_extra_info}.get(route)
+        return measure(getattr(self, route), repeat, setup)
+
+
+def reset_database(emp_app, url):
+    os.environ["DATABASE_URL"] = url
+    emp_app._schema_ready = False
+    conn = emp_app.get_connection()
+    emp_app.init_db(conn)
+    if not isinstance(conn, emp_app.sqlite3.Connection):
+        conn.cursor().execute("TRUNCATE employee, upload_log, employee_summary RESTART IDENTITY")
+        conn.commit()
+    return conn
+
+
+def backends(args, workdir):
+    yield "sqlite", lambda size: "sqlite:///" + os.path.join(workdir, f"bench_{size}.db")
+    pg_url = args.postgres_url or os.getenv("BENCH_POSTGRES_URL")
+    if not pg_url:
+        return
+    try:
+        import psycopg2
+        psycopg2.connect(pg_url).close()
+    except Exception as e:
+        print(f"Skipping Postgres ({e})")
+        return
+    yield "postgres", lambda size: pg_url
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as fh:
+        baseline = {(r["route"], r["size"]): r for r in json.load(fh)["results"]}
+    print(f"\nvs {os.path.basename(baseline_path)}")
+    print(f"{'route':<18} {'rows':>8} {'p50 before':>11} {'p50 now':>9} {'change':>8}")
+    for r in results:
+        old = baseline.get((r["route"], r["size"]))
+        if not old:
+            continue
+        change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        print(f"{r['route']:<18} {r['size']:>8} {old['p50_ms']:>11.2f} {r['p50_ms']:>9.2f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma-separated subset of: " + ", ".join(ROUTES))
+    parser.add_argument("--repeat", type=int, default=50, help="timed requests per light route")
+    parser.add_argument("--heavy-repeat", type=int, default=5, help="timed requests for export/stream/upload")
+    parser.add_argument("--upload-rows", type=int, default=1000, help="rows per uploaded workbook")
+    parser.add_argument("--postgres-url", help="scratch database (default: $BENCH_POSTGRES_URL)")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>-<backend>.json)")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)}")
+
+    # app reads these at import; running from the temp dir keeps uploads/ and jobs.db out of the repo
+    workdir = tempfile.mkdtemp(prefix="emp_bench_")
+    os.environ["JOB_RUNNER"] = "inline"
+    os.environ["JOBS_DB_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ["CACHE_BACKEND"] = os.getenv("CACHE_BACKEND", "memory") if args.cache else "none"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    sys.path.insert(0, HERE)
+    import app as emp_app
+    import datagen
+
+    commit, dirty = git_commit()
+    for backend, url_for_size in backends(args, workdir):
+        results = []
+        print(f"\n[{backend}] commit {commit}{' (dirty)' if dirty else ''}")
+        print(f"{'route':<18} {'rows':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak KB':>9}")
+        for size in args.sizes:
+            conn = reset_database(emp_app, url_for_size(size))
+            start = time.perf_counter()
+            datagen.seed_database(conn, size, random.Random(args.seed))
+            conn.close()
+            print(f"{'(seed)':<18} {size:>8} {(time.perf_counter() - start) * 1000:>9.0f}")
+
+            bench = RouteBench(emp_app, datagen, emp_app.app.test_client(), workdir, args)
+            for route in routes:
+                r = {"route": route, "size": size, **bench.run(route)}
+                results.append(r)
+                print(f"{route:<18} {size:>8} {r['p50_ms']:>9.2f} {r['p90_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+                      f"{r['rps']:>9.1f} {r['peak_kb']:>9.0f}")
+
+        output = args.output or os.path.join(HERE, "results", f"{commit}-{backend}.json")
+        if args.output and backend != "sqlite":
+            root, ext = os.path.splitext(args.output)
+            output = f"{root}-{backend}{ext}"
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as fh:
+            json.dump({
+                "commit": commit,
+                "dirty": dirty,
+                "backend": backend,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "postgres_url")},
+                "results": results,
+            }, fh, indent=2)
+        print(f"Results written to {output}")
+
+        if args.compare:
+            print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
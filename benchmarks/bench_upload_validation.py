@@ -0,0 +1,116 @@
+# Benchmark: Excel upload validation, df.iterrows() loop vs column-wise validate_upload_frame.
+#
+#   python benchmarks/bench_upload_validation.py --sizes 1000 10000 50000
+#
+# Both implementations run on the same synthetic frame and their outputs are
+# compared before timings are reported.
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as emp_app  # noqa: E402
+from datagen import CORE, PREMIUM, make_frame  # noqa: E402
+
+
+def legacy_validate(df, existing_code_year):
+    # The original row-by-row validation from upload_excel, kept for comparison
+    required_cols = emp_app.UPLOAD_REQUIRED_COLS
+    safe_float = emp_app.safe_float
+    df = df.copy()
+    df["_code_year"] = df.apply(
+        lambda r: (str(r["code"]).strip().lower() if pd.notna(r["code"]) else "",
+                   str(r["year"]).strip() if pd.notna(r["year"]) else ""),
+        axis=1
+    )
+    code_year_counts = df["_code_year"].value_counts()
+
+    skipped_details = []
+    valid_rows = []
+    for idx, row in df.iterrows():
+        errors = []
+        code = str(row.get("code")).strip() if pd.notna(row.get("code")) else ""
+        full_name = str(row.get("full_name")).strip() if pd.notna(row.get("full_name")) else ""
+        title = str(row.get("title")).strip() if pd.notna(row.get("title")) else ""
+        if not code:
+            errors.append("Missing employee code")
+        if not full_name:
+            errors.append("Missing full name")
+        year = str(row.get("year")).strip() if pd.notna(row.get("year")) else ""
+        if code_year_counts.get((code.lower(), year), 0) > 1:
+            errors.append(f"Duplicate code {code} with year {year} in file")
+        if (code.lower(), year) in existing_code_year:
+            errors.append(f"Employee code {code} with year {year} already exists in database")
+
+        data = {}
+        for k in df.columns:
+            if k not in required_cols and not str(k).startswith("_"):
+                val = row.get(k)
+                if pd.isna(val) or (isinstance(val, str) and val.strip() == ""):
+                    data[k] = None
+                else:
+                    data[k] = safe_float(val)
+
+        core_fields = list(CORE)
+        core_req_fields = [k + "_req" for k in CORE]
+        premium_fields = list(PREMIUM)
+        premium_req_fields = [k + "_req" for k in PREMIUM]
+        if title in ["Officer", "Senior"]:
+            for f in premium_fields + premium_req_fields:
+                val = row.get(f)
+                if pd.notna(val) and str(val).strip() != "":
+                    errors.append(f"{title} not allowed to fill {f}")
+                data[f] = None
+        else:
+            core_fields += premium_fields
+            core_req_fields += premium_req_fields
+
+        for key in core_fields + core_req_fields:
+            if key not in data:
+                data[key] = None
+            if data.get(key) is None:
+                errors.append(f"Missing value for {key} (core competency)")
+
+        if errors:
+            skipped_details.append({"row": idx + 2, "code": code, "full_name": full_name,
+                                    "reason": "; ".join(errors)})
+            continue
+        valid_rows.append({
+            "year": row.get("year"), "code": code, "full_name": full_name, "title": title,
+            "department": row.get("department"), "division": row.get("division"), **data
+        })
+    return valid_rows, skipped_details
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'iterrows (s)':>13} {'column-wise (s)':>16} {'speedup':>8}")
+    for n in args.sizes:
+        rng = random.Random(args.seed)
+        df = make_frame(n, rng)
+        existing = {(f"e{i}", "2025") for i in range(0, n * 4, 7)}
+
+        start = time.perf_counter()
+        legacy_rows, legacy_skipped = legacy_validate(df, existing)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows, skipped, _ = emp_app.validate_upload_frame(df, existing)
+        vectorized = time.perf_counter() - start
+
+        assert skipped == legacy_skipped, "skipped_details differ"
+        assert [row._asdict() for row in rows] == legacy_rows, "valid_rows differ"
+        print(f"{n:>8} {legacy:>13.3f} {vectorized:>16.3f} {legacy / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
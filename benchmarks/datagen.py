@@ -0,0 +1,133 @@
+# Synthetic data for the benchmarks: employee rows, upload frames/workbooks in
+# the template layout, and a seeded database.
+#
+#   python benchmarks/datagen.py --rows 100000 --out employees.xlsx
+#
+# Everything takes a random.Random so runs are reproducible.
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as emp_app  # noqa: E402
+
+CORE = list(emp_app.competency_keys("core"))
+PREMIUM = list(emp_app.competency_keys("premium"))
+NEW = list(emp_app.competency_keys("new"))
+TITLES = ["Officer", "Senior", "Supervisor", "Manager", "Director"]
+YEARS = ["2023", "2024", "2025"]
+DIVISIONS = ["IT Division", "Finance Division", "Operations Division", "HR Division"]
+DEPARTMENTS = ["Software Department", "Data Department", "Accounting Department",
+               "Logistics Department", "Recruitment Department"]
+
+UPLOAD_COLUMNS = (emp_app.UPLOAD_REQUIRED_COLS
+                  + [k for key in CORE + PREMIUM + NEW for k in (key, key + "_req")])
+
+
+def make_employee(i, rng, prefix="E"):
+    # One valid employee as a dict in the upload layout
+    title = rng.choice(TITLES)
+    row = {
+        "year": rng.choice(YEARS),
+        "code": f"{prefix}{i:07d}",
+        "full_name": f"Employee {i}",
+        "title": title,
+        "department": rng.choice(DEPARTMENTS),
+        "division": rng.choice(DIVISIONS),
+    }
+    for k in CORE + PREMIUM + NEW:
+        restricted = k in PREMIUM and title in emp_app.CLASSIFICATION_RESTRICTED_TITLES
+        row[k] = None if restricted else round(rng.uniform(1, 5), 1)
+        row[k + "_req"] = None if restricted else round(rng.uniform(1, 5), 1)
+    return row
+
+
+def make_employees(n, rng, prefix="E", start=0):
+    return [make_employee(i, rng, prefix) for i in range(start, start + n)]
+
+
+def make_frame(n, rng):
+    # Upload frame with the usual mistakes mixed in: missing names and scores,
+    # out-of-range values, duplicate codes and premium scores on Officer/Senior
+    rows = []
+    for i in range(n):
+        title = rng.choice(TITLES)
+        row = {
+            "year": rng.choice([2024, 2025]),
+            "code": f"E{rng.randrange(n * 4)}",
+            "full_name": f"Employee {i}" if rng.random() > 0.01 else None,
+            "title": title,
+            "department": "Software Department",
+            "division": "IT Division",
+        }
+        for k in CORE + PREMIUM + NEW:
+            for col in (k, k + "_req"):
+                r = rng.random()
+                if r < 0.02:
+                    row[col] = None
+                elif r < 0.03:
+                    row[col] = rng.choice([0, 7, "abc", " 3 "])
+                else:
+                    row[col] = round(rng.uniform(1, 5), 1)
+        if title in emp_app.CLASSIFICATION_RESTRICTED_TITLES and rng.random() > 0.05:
+            for k in PREMIUM:
+                row[k] = row[k + "_req"] = None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_workbook(path, rows):
+    # .csv or .xlsx (openpyxl write-only, so 1M rows don't need to fit in a DataFrame)
+    if str(path).lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(UPLOAD_COLUMNS)
+            for row in rows:
+                writer.writerow(["" if row.get(k) is None else row.get(k) for k in UPLOAD_COLUMNS])
+        return path
+
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Employees")
+    ws.append(UPLOAD_COLUMNS)
+    for row in rows:
+        ws.append([row.get(k) for k in UPLOAD_COLUMNS])
+    wb.save(path)
+    return path
+
+
+def seed_database(conn, n, rng, prefix="E"):
+    # Inserts n classified employees the way an upload commit does
+    table_name = "public.employee" if not isinstance(conn, sqlite3.Connection) else "employee"
+
+    def values():
+        for i in range(n):
+            row = make_employee(i, rng, prefix)
+            record = emp_app.EmployeeRecord._make([row[k] for k in emp_app.EMPLOYEE_INPUT_FIELDS])
+            yield (*record, "Pending", "Pending", *emp_app.record_pct(record))
+
+    emp_app.bulk_insert(conn, table_name, emp_app.EMPLOYEE_INPUT_FIELDS + ["classification_core", "classification_new",
+                                                                         "pct_core", "pct_new"], values())
+    emp_app.reclassify_all(conn, table_name)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--out", default="employees.xlsx", help=".xlsx or .csv")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    write_workbook(args.out, make_employees(args.rows, random.Random(args.seed)))
+    print(f"Wrote {args.rows} rows to {args.out}")
+
+
+if __name__ == "__main__":
+    main()